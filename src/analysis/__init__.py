@@ -0,0 +1,2 @@
+from .ingest import Trajectories, ingest, read_csvs, read_store
+from .measures import drift_per_depth, rec_slant_distribution, filter_bubble, rabbit_hole, cohorts
@@ -0,0 +1,133 @@
+import sqlite3
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import config
+
+try:
+    import pyarrow # parquet support is optional, datasets fall back to pickle
+except ImportError:
+    pyarrow = None
+
+PUPPET_COLUMNS = ["puppet_id", "initial_slant", "target_slant"]
+WATCH_COLUMNS = ["puppet_id", "depth", "state", "puppet_slant", "video_id", "video_slant"]
+REC_COLUMNS = ["puppet_id", "depth", "state", "puppet_slant", "video_slant", "position", "rec_id", "rec_slant", "inferred"]
+
+CATEGORIES = ["puppet_id", "state"]
+
+
+@dataclass
+class Trajectories():
+    """Puppet runs as flat tables: one row per puppet, per watch and per recommendation"""
+    puppets : pd.DataFrame
+    watches : pd.DataFrame
+    recs : pd.DataFrame
+
+
+    def save(self, path : Path) -> Path:
+        """ Parquet when pyarrow is installed, pickle otherwise """
+        path.mkdir(parents=True, exist_ok=True)
+        for name in ("puppets", "watches", "recs"):
+            df = getattr(self, name)
+            if pyarrow is not None:
+                df.to_parquet(path / f"{name}.parquet", index=False)
+            else:
+                df.to_pickle(path / f"{name}.pkl")
+        return path
+
+
+    @classmethod
+    def load(cls, path : Path) -> "Trajectories":
+        def read(name):
+            parquet = path / f"{name}.parquet"
+            return pd.read_parquet(parquet) if parquet.exists() else pd.read_pickle(path / f"{name}.pkl")
+        return cls(read("puppets"), read("watches"), read("recs"))
+
+
+    @classmethod
+    def concat(cls, parts : list["Trajectories"]) -> "Trajectories":
+        """ Stack sources. Earlier parts win when a puppet depth appears twice """
+        def stack(name, keys):
+            frames = [getattr(p, name) for p in parts if len(getattr(p, name))]
+            if not frames:
+                return getattr(parts[0], name)
+            df = pd.concat([f.astype({c: "object" for c in CATEGORIES if c in f}) for f in frames], ignore_index=True)
+            return categorize(df.drop_duplicates(keys, keep="first", ignore_index=True))
+
+        return cls(
+            stack("puppets", ["puppet_id"]),
+            stack("watches", ["puppet_id", "depth"]),
+            stack("recs", ["puppet_id", "depth", "position"]),
+        )
+
+
+def categorize(df : pd.DataFrame) -> pd.DataFrame:
+    return df.astype({column: "category" for column in CATEGORIES if column in df})
+
+
+def split_lists(col : pd.Series) -> tuple[np.ndarray, list[str]]:
+    """ Lengths and flattened items of a column of stringified lists, e.g. "['a', 'b']". One join and one split instead of literal_eval per row """
+    inner = col.fillna("[]").str.slice(1, -1)
+    lengths = np.where(inner == "", 0, inner.str.count(", ") + 1)
+    items = ", ".join(inner[inner != ""]).split(", ") if lengths.sum() else []
+    return lengths, items
+
+
+def read_csvs(csv_dir : Path = config.PUPPETS_DIR) -> Trajectories:
+    """ Per-puppet CSVs written at the end of a run. They carry no target slant, and the initial slant is the first recorded one """
+    files = sorted(Path(csv_dir).glob("*.csv"))
+    frames = [pd.read_csv(f, usecols=["puppet_id", "puppet_state", "puppet_slant", "depth", "video_id", "video_slant", "recs_id", "recs_slant"]) for f in files]
+    if not frames:
+        return empty()
+
+    df = pd.concat(frames, ignore_index=True).rename(columns={"puppet_state": "state"})
+    watches = categorize(df[WATCH_COLUMNS].copy())
+
+    lengths, ids = split_lists(df["recs_id"])
+    slant_lengths, slants = split_lists(df["recs_slant"])
+    if not np.array_equal(lengths, slant_lengths):
+        raise ValueError("recs_id and recs_slant lengths differ")
+
+    rows = np.repeat(np.arange(len(df)), lengths)
+    starts = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    recs = df.loc[rows, ["puppet_id", "depth", "state", "puppet_slant", "video_slant"]].reset_index(drop=True)
+    recs["position"] = np.arange(len(rows)) - starts
+    recs["rec_id"] = pd.Series(ids, dtype="object").str.strip("'\"")
+    recs["rec_slant"] = pd.to_numeric(pd.Series(slants), errors="coerce") # None and nan become NaN
+    recs["inferred"] = np.nan # not exported to CSV
+
+    first = df.sort_values("depth").drop_duplicates("puppet_id")
+    puppets = pd.DataFrame({"puppet_id": first["puppet_id"].to_numpy(), "initial_slant": first["puppet_slant"].to_numpy(), "target_slant": np.nan})
+
+    return Trajectories(categorize(puppets), watches, categorize(recs))
+
+
+def read_store(path : Path = config.TRAJECTORY_DB_PATH) -> Trajectories:
+    """ Trajectory sqlite written by TrajectoryWriter """
+    con = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        puppets = pd.read_sql("SELECT id AS puppet_id, initial_slant, target_slant FROM puppet", con)
+        watches = pd.read_sql(f"SELECT {', '.join(WATCH_COLUMNS)} FROM watch", con)
+        recs = pd.read_sql("""
+            SELECT r.puppet_id, r.depth, w.state, w.puppet_slant, w.video_slant, r.position, r.video_id AS rec_id, r.slant AS rec_slant, r.inferred
+            FROM rec r JOIN watch w ON w.puppet_id = r.puppet_id AND w.depth = r.depth
+            """, con)
+    finally:
+        con.close()
+
+    return Trajectories(categorize(puppets), categorize(watches), categorize(recs))
+
+
+def empty() -> Trajectories:
+    return Trajectories(pd.DataFrame(columns=PUPPET_COLUMNS), pd.DataFrame(columns=WATCH_COLUMNS), pd.DataFrame(columns=REC_COLUMNS))
+
+
+def ingest(csv_dir : Path | None = config.PUPPETS_DIR, store : Path | None = config.TRAJECTORY_DB_PATH) -> Trajectories:
+    """ Everything on disk, the trajectory store taking precedence over CSV exports of the same puppets """
+    parts = []
+    if store is not None and Path(store).exists(): parts.append(read_store(store))
+    if csv_dir is not None and Path(csv_dir).exists(): parts.append(read_csvs(csv_dir))
+    return Trajectories.concat(parts) if parts else empty()
@@ -0,0 +1,100 @@
+import numpy as np
+import pandas as pd
+
+from .ingest import Trajectories
+
+BINS = np.linspace(-1, 1, 11)
+
+
+def with_cohort(df : pd.DataFrame, t : Trajectories) -> pd.DataFrame:
+    """ Attach initial and target slant of each row's puppet """
+    puppets = t.puppets.astype({"puppet_id": "object"})
+    return df.astype({"puppet_id": "object"}).merge(puppets, on="puppet_id", how="left")
+
+
+def slope(df : pd.DataFrame, by : list[str], x : str, y : str) -> pd.Series:
+    """ Least squares slope of y over x per group, from grouped sums """
+    d = pd.DataFrame({k: df[k] for k in by}).assign(x=df[x], y=df[y], xy=df[x] * df[y], xx=df[x] ** 2, n=1)
+    s = d.dropna().groupby(by, observed=True).sum()
+    den = s["n"] * s["xx"] - s["x"] ** 2
+    return ((s["n"] * s["xy"] - s["x"] * s["y"]) / den.where(den != 0)).rename(f"{y}_slope")
+
+
+def drift_per_depth(t : Trajectories, by : list[str] = []) -> pd.DataFrame:
+    """ Watched video slant and its distance from the initial slant at every depth """
+    w = with_cohort(t.watches, t)
+    w["drift"] = w["video_slant"] - w["initial_slant"]
+    return w.groupby([*by, "depth"], observed=True).agg(
+        puppets=("puppet_id", "nunique"),
+        puppet_slant=("puppet_slant", "mean"),
+        video_slant=("video_slant", "mean"),
+        video_slant_std=("video_slant", "std"),
+        drift=("drift", "mean"),
+    )
+
+
+def rec_slant_distribution(t : Trajectories, bins : np.ndarray = BINS) -> pd.DataFrame:
+    """ Share of scored recommendations per slant bin, per puppet state """
+    recs = t.recs.dropna(subset=["rec_slant"])
+    binned = pd.cut(recs["rec_slant"], bins, include_lowest=True)
+    return pd.crosstab(recs["state"], binned, normalize="index")
+
+
+def filter_bubble(t : Trajectories, margin : float = 0.2) -> pd.DataFrame:
+    """ Per puppet and state: share of recommendations within margin of the puppet's slant, and mean per-watch spread of rec slants.
+    High share and low spread means the recommendations mirror the puppet """
+    r = t.recs.dropna(subset=["rec_slant"])
+    near = (r["rec_slant"] - r["puppet_slant"]).abs() <= margin
+    per_watch = r.assign(near=near).groupby(["puppet_id", "state", "depth"], observed=True).agg(
+        near=("near", "mean"),
+        spread=("rec_slant", "std"),
+    )
+    return per_watch.groupby(["puppet_id", "state"], observed=True).mean().rename(columns={"near": "bubble"})
+
+
+def rabbit_hole(t : Trajectories) -> pd.DataFrame:
+    """ Per puppet and state: how far recommendations lean past the watched video towards its own extreme (pull),
+    and the slope of watched-video extremity over depth """
+    r = t.recs.dropna(subset=["rec_slant", "video_slant"])
+    pull = (np.sign(r["video_slant"]) * (r["rec_slant"] - r["video_slant"])).groupby([r["puppet_id"], r["state"]], observed=True).mean()
+
+    w = t.watches.assign(extremity=t.watches["video_slant"].abs())
+    return pd.concat([pull.rename("pull"), slope(w, ["puppet_id", "state"], "depth", "extremity")], axis=1)
+
+
+def final_slants(t : Trajectories) -> pd.DataFrame:
+    """ Last watched video and puppet slant of every puppet """
+    last = t.watches.sort_values("depth").drop_duplicates("puppet_id", keep="last")
+    last = last.astype({"puppet_id": "object"}).set_index("puppet_id")
+    return last[["depth", "puppet_slant", "video_slant"]].rename(columns=lambda c: f"final_{c}")
+
+
+def in_state(df : pd.DataFrame, state : str) -> pd.DataFrame:
+    """ Rows of a (puppet_id, state) indexed frame for one state, indexed by puppet id """
+    df = df.reset_index()
+    df = df[df["state"] == state].drop(columns="state")
+    return df.astype({"puppet_id": "object"}).set_index("puppet_id")
+
+
+def cohorts(t : Trajectories, margin : float = 0.2, decimals : int = 1) -> pd.DataFrame:
+    """ Compare initial/target slant cohorts on where they ended up and how closed in their recommendations were while drifting.
+    Slants are rounded to decimals to form the cohorts """
+    per_puppet = t.puppets.astype({"puppet_id": "object"}).set_index("puppet_id")
+    per_puppet = per_puppet.join(final_slants(t)) \
+        .join(in_state(filter_bubble(t, margin), "drifting")) \
+        .join(in_state(rabbit_hole(t), "drifting"))
+    per_puppet["moved"] = per_puppet["final_video_slant"] - per_puppet["initial_slant"]
+    per_puppet["gap"] = (per_puppet["target_slant"] - per_puppet["final_video_slant"]).abs()
+
+    cohort = per_puppet[["initial_slant", "target_slant"]].round(decimals)
+    return per_puppet.groupby([cohort["initial_slant"], cohort["target_slant"]], dropna=False).agg(
+        puppets=("final_depth", "size"),
+        depth=("final_depth", "mean"),
+        final_video_slant=("final_video_slant", "mean"),
+        moved=("moved", "mean"),
+        gap=("gap", "mean"),
+        bubble=("bubble", "mean"),
+        spread=("spread", "mean"),
+        pull=("pull", "mean"),
+        extremity_slope=("extremity_slope", "mean"),
+    )
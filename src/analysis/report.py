@@ -0,0 +1,48 @@
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import config
+from .ingest import Trajectories, ingest
+from .measures import drift_per_depth, rec_slant_distribution, filter_bubble, rabbit_hole, cohorts
+
+
+def report(t : Trajectories, margin : float = 0.2, bins : int = 10, decimals : int = 1):
+    sections = {
+        "Drift per depth": drift_per_depth(t),
+        "Rec slant distribution per state": rec_slant_distribution(t, np.linspace(-1, 1, bins + 1)),
+        "Filter bubble per state": filter_bubble(t, margin).groupby("state", observed=True).describe().T,
+        "Rabbit hole per state": rabbit_hole(t).groupby("state", observed=True).describe().T,
+        "Cohorts": cohorts(t, margin, decimals),
+    }
+    with pd.option_context("display.width", 200, "display.max_columns", 20, "display.precision", 3):
+        for title, df in sections.items():
+            print(f"\n{title}\n{df}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest puppet trajectories and report drift, filter-bubble and rabbit-hole metrics")
+    parser.add_argument("--csv-dir", type=Path, default=config.PUPPETS_DIR, help="per-puppet CSV exports")
+    parser.add_argument("--store", type=Path, default=config.TRAJECTORY_DB_PATH, help="trajectory sqlite")
+    parser.add_argument("--dataset", type=Path, default=config.ROOT / "data" / "analysis", help="where the flat tables are saved")
+    parser.add_argument("--from-dataset", action="store_true", help="load the saved tables instead of ingesting")
+    parser.add_argument("--margin", type=float, default=0.2, help="slant distance counted as inside the bubble")
+    parser.add_argument("--bins", type=int, default=10)
+    parser.add_argument("--decimals", type=int, default=1, help="rounding of initial/target slants into cohorts")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.from_dataset:
+        t = Trajectories.load(args.dataset)
+    else:
+        t = ingest(args.csv_dir, args.store)
+        t.save(args.dataset)
+    loaded = time.perf_counter() - start
+    print(f"{len(t.puppets)} puppets, {len(t.watches)} watches, {len(t.recs)} recs in {loaded:.2f}s")
+
+    start = time.perf_counter()
+    report(t, args.margin, args.bins, args.decimals)
+    print(f"\nMetrics in {time.perf_counter() - start:.2f}s")
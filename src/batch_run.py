@@ -1,25 +1,50 @@
+import argparse
 import asyncio
+from pathlib import Path
 
-from puppet import YTPuppet
+from puppet import YTPuppet, BrowserPool
+from supervisor import Supervisor, PuppetSpec, run_isolated
+from metrics import registry
+from data_fetcher import db
+import config
 
 N = 10
 SLANTS = [(-1, 0), (-0.5, 0), (0, 1), (0.5, 0), (1, 0)] #tuple[0] = initial slant | tuple[1] = target slant
 
-async def main():
-
+def partitions() -> list[PuppetSpec]:
     if N % len(SLANTS) != 0:
         raise Exception("SLANTS length must be divisible with N")
 
     k = N // len(SLANTS)
-    partitions = SLANTS * k
+    return [PuppetSpec(f"puppet-{i}", slant=s[0], target_slant=s[1]) for i, s in enumerate(SLANTS * k)]
+
 
-    puppets = [YTPuppet(f"puppet-{i}", slant=s[0], target_slant=s[1]) for i, s in enumerate(partitions)]
+async def main():
+    """Run the whole batch in this process"""
+    async with BrowserPool() as pool: # puppets share a few browser processes
+        puppets = [YTPuppet(s.id, slant=s.slant, target_slant=s.target_slant, pool=pool) for s in partitions()]
+
+        # a failing puppet is retried or skipped, never cancels its siblings
+        await asyncio.gather(*[run_isolated(puppet, config.PUPPET_RETRIES) for puppet in puppets])
 
-    async with asyncio.TaskGroup() as tg:
-        tasks = [tg.create_task(puppet.run()) for puppet in puppets]
+        print(f"Browser pool stats: {pool.stats()}")
 
     return puppets
 
 if __name__ == "__main__":
-    puppets = asyncio.run(main())
-
+    parser = argparse.ArgumentParser(description="Run the sock-puppet batch")
+    parser.add_argument("--workers", type=int, default=config.WORKERS, help="worker processes, 0 runs in this process")
+    parser.add_argument("--per-worker", type=int, default=config.PUPPETS_PER_WORKER)
+    parser.add_argument("--driver", default="puppet.youtube_driver.YouTubeDriver")
+    parser.add_argument("--metrics", type=Path, default=None, help="export metrics, Prometheus text for .prom, JSON lines otherwise")
+    args = parser.parse_args()
+
+    db.init() # workers share the db built here
+
+    if args.workers == 0:
+        puppets = asyncio.run(main())
+        print(registry.summary())
+    else:
+        Supervisor(workers=args.workers, per_worker=args.per_worker, driver=args.driver).run(partitions())
+
+    if args.metrics: registry.export(args.metrics)
@@ -0,0 +1,146 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+import numpy as np
+
+import config
+from data_fetcher import db
+from models import Video
+
+logger = logging.getLogger("SlantInference")
+
+
+def load_model():
+    """Default model: the persisted SlantModel, see python -m classifier.tf_idf train"""
+    from .tf_idf import SlantModel # sklearn and pandas load with the model, not with the puppets
+
+    model = SlantModel.load(config.SLANT_MODEL_PATH)
+    return model, model.version
+
+
+def confidence(vids : list[Video]) -> np.ndarray:
+    """Share of the text fields the model uses that are present"""
+    return np.array([sum(bool(x) for x in (v.title, v.description, v.tags)) / 3 for v in vids])
+
+
+class SlantInferer():
+    """Batches unknown recommendation ids across puppets, fetches their metadata and predicts slants.
+    Results are kept in a bounded LRU and the slant_cache table"""
+    def __init__(self, model_loader : Callable = load_model, batch_size : int = config.INFERENCE_BATCH_SIZE,
+                 linger : float = 0.2, cache_size : int = config.SLANT_CACHE_SIZE):
+        self.model_loader = model_loader
+        self.batch_size = batch_size
+        self.linger = linger # wait for other puppets' ids before running a batch
+        self.cache_size = cache_size
+
+        self._model = None
+        self._version : str | None = None
+        self._lru : OrderedDict[str, float | None] = OrderedDict()
+        self._pending : dict[str, asyncio.Future] = {}
+        self._queue : list[str] = []
+        self._wakeup = asyncio.Event()
+        self._task : asyncio.Task | None = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="slant-inference")
+
+
+    def remember(self, id : str, slant : float | None):
+        self._lru[id] = slant
+        self._lru.move_to_end(id)
+        if len(self._lru) > self.cache_size:
+            self._lru.popitem(last=False)
+
+
+    async def infer(self, ids : list[str], deadline : float = config.INFERENCE_DEADLINE) -> dict[str, float]:
+        """Slants for the given ids that are known or inferred within deadline seconds. Late results still land in the cache"""
+        loop = asyncio.get_running_loop()
+        result, waiting = {}, {}
+
+        for id in ids:
+            if id in self._lru:
+                self._lru.move_to_end(id)
+                if self._lru[id] is not None: result[id] = self._lru[id]
+                continue
+
+            future = self._pending.get(id)
+            if future is None:
+                future = self._pending[id] = loop.create_future()
+                self._queue.append(id)
+            waiting[id] = future
+
+        if waiting:
+            if self._task is None or self._task.done():
+                self._task = asyncio.create_task(self.worker())
+            self._wakeup.set()
+            await asyncio.wait(waiting.values(), timeout=deadline)
+
+            for id, future in waiting.items():
+                if future.done() and future.result() is not None: result[id] = future.result()
+
+        return result
+
+
+    async def worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._wakeup.wait()
+            await asyncio.sleep(self.linger)
+            self._wakeup.clear()
+
+            while self._queue:
+                batch, self._queue = self._queue[:self.batch_size], self._queue[self.batch_size:]
+                try:
+                    slants = await loop.run_in_executor(self._executor, self.infer_batch, batch)
+                except Exception as e:
+                    logger.warning(f"Slant inference failed for {len(batch)} videos: {e}")
+                    slants = {}
+
+                for id in batch:
+                    slant = slants.get(id)
+                    if id in slants: self.remember(id, slant)
+                    future = self._pending.pop(id, None)
+                    if future is not None and not future.done(): future.set_result(slant)
+
+
+    def infer_batch(self, ids : list[str]) -> dict[str, float | None]:
+        """Blocking: cache table, then metadata fetch and one vectorised predict for the rest"""
+        if self._model is None:
+            self._model, self._version = self.model_loader()
+
+        slants = db.get_cached_slants(ids, self._version)
+        missing = [Video(id) for id in ids if id not in slants]
+        if not missing:
+            return slants
+
+        from data_fetcher.youtube_api import fetch_metadata # requests only loads once a batch needs metadata
+
+        fetched, unavailable = [], []
+        for chunk, result in fetch_metadata(missing):
+            if isinstance(result, Exception):
+                logger.warning(f"Metadata fetch failed: {result}")
+                continue
+            fetched.extend(result.videos)
+            unavailable.extend(result.missing)
+
+        rows = [(v.id, None, 0.0) for v in unavailable]
+        if fetched:
+            from .tf_idf import video_frame
+            pred = np.clip(self._model.predict(video_frame(fetched)), -1, 1)
+            rows.extend(zip([v.id for v in fetched], pred.tolist(), confidence(fetched).tolist()))
+
+        db.cache_slants(rows, self._version)
+        slants.update((id, slant) for id, slant, _ in rows)
+        return slants
+
+
+_inferer : SlantInferer | None = None
+
+
+def get_inferer() -> SlantInferer:
+    """One inferer per process, so batches span all puppets"""
+    global _inferer
+    if _inferer is None:
+        _inferer = SlantInferer()
+    return _inferer
@@ -1,59 +1,290 @@
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.linear_model import Ridge
-from sklearn.pipeline import Pipeline
-from sklearn.model_selection import train_test_split, GridSearchCV
-from sklearn.metrics import mean_squared_error, mean_absolute_error, r2_score, make_scorer
+from sklearn.feature_extraction.text import TfidfVectorizer, HashingVectorizer, TfidfTransformer
+from sklearn.linear_model import Ridge, RidgeCV
+from sklearn.pipeline import Pipeline, make_pipeline
+from sklearn.model_selection import train_test_split, KFold
+from sklearn.metrics import mean_squared_error, mean_absolute_error, r2_score
 from sklearn.compose import ColumnTransformer
 from sklearn.preprocessing import OneHotEncoder
 
 import pandas as pd
 import numpy as np
+import joblib
+from joblib import Parallel, delayed
 
-from dataclasses import asdict
 from functools import lru_cache
+from itertools import islice
+from pathlib import Path
+from typing import Iterable, Iterator
+import argparse
+import time
+import tracemalloc
+
+import config
+from data_fetcher import db
+from data_fetcher.db import get_connection, is_compact
+from models import Video
+
+# text columns come out vectorizer-ready: no NULLs, tags space separated, no Video objects in between
+TRAIN_SQL = """
+SELECT
+  COALESCE(title, '') AS title,
+  {description} AS description,
+  COALESCE(category, '') AS category,
+  {tags} AS tags,
+  slant
+FROM video
+WHERE slant BETWEEN ? AND ? AND blacklist != 1
+"""
+
+#legacy layout: comma joined tag text, joined in sql
+LEGACY_COLUMNS = {"description": "COALESCE(description, '')", "tags": "REPLACE(COALESCE(tags, ''), ',', ' ')"}
+#compact layout: bare columns so the ZTEXT and TAGIDS converters decode them
+COMPACT_COLUMNS = {"description": "description", "tags": "tags"}
+
+
+def load_training_frame(slant_range : tuple[float,float] = (-1,1), chunksize : int = 50_000) -> pd.DataFrame:
+    """Read the training columns straight from sqlite in chunks"""
+    compact = is_compact()
+    sql = TRAIN_SQL.format(**(COMPACT_COLUMNS if compact else LEGACY_COLUMNS))
+
+    #computed columns carry no decltype, so the TAGLIST converter never runs
+    chunks = pd.read_sql(sql, get_connection(), params=slant_range, chunksize=chunksize)
+    df = pd.concat(chunks, ignore_index=True)
+
+    if compact:
+        df["description"] = df["description"].fillna("")
+        df["tags"] = [" ".join(tags) if tags else "" for tags in df["tags"]]
+
+    df["category"] = df["category"].astype("category")
+    return df
 
-from data_fetcher import get_videos
 
 @lru_cache(maxsize=1)
 def build_train_test():
-    vids = get_videos((-1,1))
-    df = pd.DataFrame([asdict(vid) for vid in vids])
-    X = df[["title", "description", "category", "tags"]].fillna("")
-    X["tags"] = X["tags"].apply(lambda x: " ".join(x))
-    y = df["slant"]
-    return (X, y)
-
-X, y = build_train_test()
-
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-
-features = ColumnTransformer(
-    transformers=[
-        ("title", TfidfVectorizer(analyzer="char_wb", ngram_range=(3,5), min_df=2, sublinear_tf=True), "title"),
-        ("description",  TfidfVectorizer(stop_words="english", ngram_range=(1,2), min_df=3, max_df=0.9, sublinear_tf=True), "description"),
-        ("tags", TfidfVectorizer(stop_words=None), "tags"),
-        ("category",  OneHotEncoder(), ["category"]),
-    ],
-)
-
-pipe = Pipeline([("feats", features), ("reg", Ridge(alpha=0.5))])
-
-g = GridSearchCV(
-    pipe,
-    {"reg__alpha": np.logspace(-3, 2, 12)},
-    cv=5,
-    scoring=make_scorer(mean_absolute_error, greater_is_better=False),
-    n_jobs=-1,
-)
-
-pipe.fit(X_train, y_train).score(X_test, y_test)
-
-pred = pipe.predict(X_test)
-
-r2  = r2_score(y_test, pred)
-mae = mean_absolute_error(y_test, pred)
-rmse = mean_squared_error(y_test, pred)
-
-print(f"Model metrics: {r2}, {mae}, {rmse}")
-print(f"Baseline mean: {np.mean(np.abs(y-y.mean()))}")
-print(f"Baseline median: {np.mean(np.abs(y-y.median()))}")
\ No newline at end of file
+    df = load_training_frame()
+    return (df[["title", "description", "category", "tags"]], df["slant"])
+
+
+def video_frame(vids : list[Video]) -> pd.DataFrame:
+    """Model input for a list of videos"""
+    return pd.DataFrame({
+        "title": [v.title or "" for v in vids],
+        "description": [v.description or "" for v in vids],
+        "category": [v.category or "" for v in vids],
+        "tags": [" ".join(v.tags or []) for v in vids],
+    })
+
+
+def build_features(hashing=False) -> ColumnTransformer:
+    """TF-IDF features per text column. With hashing, no vocabulary is kept and transform is a pure hash"""
+    if hashing:
+        def text(**kwargs):
+            return make_pipeline(HashingVectorizer(alternate_sign=False, norm=None, **kwargs), TfidfTransformer(sublinear_tf=True))
+        title = text(analyzer="char_wb", ngram_range=(3,5), n_features=2**20)
+        description = text(stop_words="english", ngram_range=(1,2), n_features=2**20)
+        tags = text(n_features=2**18)
+    else:
+        title = TfidfVectorizer(analyzer="char_wb", ngram_range=(3,5), min_df=2, sublinear_tf=True)
+        description = TfidfVectorizer(stop_words="english", ngram_range=(1,2), min_df=3, max_df=0.9, sublinear_tf=True)
+        tags = TfidfVectorizer(stop_words=None)
+
+    return ColumnTransformer(
+        transformers=[
+            ("title", title, "title"),
+            ("description", description, "description"),
+            ("tags", tags, "tags"),
+            ("category", OneHotEncoder(handle_unknown="ignore"), ["category"]),
+        ],
+    )
+
+
+class SlantModel():
+    """TF-IDF + Ridge slant regressor that can be saved once and loaded for prediction"""
+    def __init__(self, alpha : float = 0.5, hashing : bool = False):
+        self.alpha = alpha
+        self.hashing = hashing
+        self.pipe = Pipeline([("feats", build_features(hashing)), ("reg", Ridge(alpha=alpha))])
+        self.fitted_at : float | None = None
+
+
+    @property
+    def version(self) -> str:
+        return f"tf_idf-{'hash' if self.hashing else 'vocab'}-a{self.alpha:g}-{int(self.fitted_at or 0)}"
+
+
+    def fit(self, X : pd.DataFrame, y : pd.Series) -> "SlantModel":
+        self.pipe.fit(X, y)
+        self.fitted_at = time.time()
+        return self
+
+
+    def predict(self, X : pd.DataFrame) -> np.ndarray:
+        return self.pipe.predict(X)
+
+
+    def predict_batch(self, vids : Iterable[Video], batch_size : int = 1000) -> Iterator[np.ndarray]:
+        """Predict a stream of videos, one array per batch"""
+        vids = iter(vids)
+        while batch := list(islice(vids, batch_size)):
+            yield self.predict(video_frame(batch))
+
+
+    def evaluate(self, X : pd.DataFrame, y : pd.Series) -> dict:
+        pred = self.predict(X)
+        return {
+            "r2": r2_score(y, pred),
+            "mae": mean_absolute_error(y, pred),
+            "rmse": float(np.sqrt(mean_squared_error(y, pred))),
+        }
+
+
+    def save(self, path : Path = config.SLANT_MODEL_PATH):
+        """Plain payload of sklearn objects, so the file doesn't reference this class, which is __main__.SlantModel when trained from the CLI"""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        payload = {"pipe": self.pipe, "alpha": self.alpha, "hashing": self.hashing, "fitted_at": self.fitted_at}
+        joblib.dump(payload, path) # uncompressed, so arrays can be memory-mapped on load
+
+
+    @classmethod
+    def load(cls, path : Path = config.SLANT_MODEL_PATH, mmap=True) -> "SlantModel":
+        payload = joblib.load(path, mmap_mode="r" if mmap else None)
+        model = cls(alpha=payload["alpha"], hashing=payload["hashing"])
+        model.pipe = payload["pipe"]
+        model.fitted_at = payload["fitted_at"]
+        return model
+
+
+def train(alpha : float, hashing : bool, out : Path):
+    X, y = build_train_test()
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+
+    model = SlantModel(alpha=alpha, hashing=hashing).fit(X_train, y_train)
+    metrics = model.evaluate(X_test, y_test)
+
+    print(f"Model metrics: {metrics}")
+    print(f"Baseline mean: {np.mean(np.abs(y-y.mean()))}")
+    print(f"Baseline median: {np.mean(np.abs(y-y.median()))}")
+
+    model.save(out)
+    print(f"Saved model {model.version} to {out}")
+
+
+def fold_scores(X : pd.DataFrame, y : pd.Series, train_idx, val_idx, alphas, hashing : bool) -> tuple[float, list[dict]]:
+    """Vectorize one fold once, then fit every alpha on the cached sparse matrices"""
+    start = time.perf_counter()
+    feats = build_features(hashing)
+    X_train = feats.fit_transform(X.iloc[train_idx])
+    X_val = feats.transform(X.iloc[val_idx])
+    vectorize_time = time.perf_counter() - start
+
+    rows = []
+    for alpha in alphas:
+        start = time.perf_counter()
+        pred = Ridge(alpha=alpha).fit(X_train, y.iloc[train_idx]).predict(X_val)
+        rows.append({
+            "alpha": alpha,
+            "mae": mean_absolute_error(y.iloc[val_idx], pred),
+            "r2": r2_score(y.iloc[val_idx], pred),
+            "fit_s": time.perf_counter() - start,
+        })
+    return vectorize_time, rows
+
+
+def select_alpha(X : pd.DataFrame, y : pd.Series, alphas, cv : int = 5, hashing : bool = False, n_jobs : int = -1) -> tuple[pd.DataFrame, float]:
+    """Cross-validated alpha sweep. Features are built once per fold (cv times instead of cv x alphas), folds run in parallel.
+    Returns the score table sorted by MAE and the total vectorization time"""
+    folds = KFold(cv, shuffle=True, random_state=42).split(X)
+    results = Parallel(n_jobs=n_jobs)(delayed(fold_scores)(X, y, tr, va, alphas, hashing) for tr, va in folds)
+
+    df = pd.DataFrame([row for _, fold in results for row in fold])
+    table = df.groupby("alpha").agg(mae=("mae", "mean"), mae_std=("mae", "std"), r2=("r2", "mean"), fit_s=("fit_s", "sum"))
+    return table.sort_values("mae"), sum(t for t, _ in results)
+
+
+def select_alpha_gcv(X : pd.DataFrame, y : pd.Series, alphas, hashing : bool = False) -> tuple[float, float]:
+    """Efficient leave-one-out over all alphas with RidgeCV on a single vectorization. Returns (best alpha, LOO MSE)"""
+    X_feats = build_features(hashing).fit_transform(X)
+    reg = RidgeCV(alphas=alphas, scoring="neg_mean_squared_error").fit(X_feats, y)
+    return reg.alpha_, -reg.best_score_
+
+
+def select(alphas, cv : int, hashing : bool, gcv : bool):
+    X, y = build_train_test()
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+
+    start = time.perf_counter()
+    if gcv:
+        alpha, mse = select_alpha_gcv(X_train, y_train, alphas, hashing)
+        print(f"RidgeCV LOO: best alpha {alpha:g}, MSE {mse:.4f}")
+    else:
+        table, vectorize_s = select_alpha(X_train, y_train, alphas, cv=cv, hashing=hashing)
+        print(table.to_string(float_format=lambda x: f"{x:.4f}"))
+        print(f"Vectorized {cv} folds once each in {vectorize_s:.2f}s (CPU time summed over folds)")
+        alpha = table.index[0]
+    print(f"Model selection wall time: {time.perf_counter() - start:.2f}s")
+
+    model = SlantModel(alpha=alpha, hashing=hashing).fit(X_train, y_train)
+    print(f"Held-out metrics at alpha {alpha:g}: {model.evaluate(X_test, y_test)}")
+
+
+def profile_load():
+    """Time and peak traced memory of loading the training frame"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    X, y = build_train_test()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"Loaded {len(X)} videos in {elapsed:.2f}s, peak memory {peak / 2**20:.1f} MiB, frame {X.memory_usage(deep=True).sum() / 2**20:.1f} MiB")
+
+
+def bench(path : Path, n : int):
+    """Load-plus-predict latency for n videos"""
+    start = time.perf_counter()
+    model = SlantModel.load(path)
+    loaded = time.perf_counter()
+
+    X, _ = build_train_test()
+    X = X.sample(n, replace=len(X) < n, random_state=0)
+    vids = [Video(id=str(i), title=r.title, description=r.description, category=r.category, tags=r.tags.split()) for i, r in enumerate(X.itertuples())]
+
+    predict_start = time.perf_counter()
+    n_pred = sum(len(p) for p in model.predict_batch(vids))
+    done = time.perf_counter()
+
+    print(f"Model {model.version}: load {loaded - start:.3f}s, predict {n_pred} videos {done - predict_start:.3f}s ({n_pred / (done - predict_start):.0f} videos/s)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train and benchmark the slant model")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p_train = sub.add_parser("train")
+    p_train.add_argument("--alpha", type=float, default=0.5)
+    p_train.add_argument("--hashing", action="store_true", help="hashing vectorizers, no vocabulary")
+    p_train.add_argument("--out", type=Path, default=config.SLANT_MODEL_PATH)
+
+    p_select = sub.add_parser("select", help="cross-validated alpha sweep")
+    p_select.add_argument("--alphas", type=float, nargs="+", default=list(np.logspace(-3, 2, 12)))
+    p_select.add_argument("--cv", type=int, default=5)
+    p_select.add_argument("--hashing", action="store_true")
+    p_select.add_argument("--gcv", action="store_true", help="RidgeCV leave-one-out instead of k-fold")
+
+    sub.add_parser("load", help="time and peak memory of the training data loader")
+
+    p_bench = sub.add_parser("bench")
+    p_bench.add_argument("--model", type=Path, default=config.SLANT_MODEL_PATH)
+    p_bench.add_argument("-n", type=int, default=10_000)
+
+    args = parser.parse_args()
+
+    db.init()
+    if args.cmd == "train":
+        train(args.alpha, args.hashing, args.out)
+    elif args.cmd == "select":
+        select(args.alphas, args.cv, args.hashing, args.gcv)
+    elif args.cmd == "load":
+        profile_load()
+    else:
+        bench(args.model, args.n)
@@ -4,15 +4,36 @@ from dotenv import load_dotenv
 import json
 
 HEADLESS = False
+MAX_BROWSERS : int = 2 #browser processes shared by a batch
+CONTEXTS_PER_BROWSER : int = 5 #puppets leasing a context from one browser at a time
+WORKERS : int = os.cpu_count() or 1 #puppet worker processes
+PUPPETS_PER_WORKER : int = 5 #puppets sharing one worker event loop
+PUPPET_RETRIES : int = 1 #reruns of a failed puppet before it is skipped
+INFER_SLANTS : bool = True #score recommendations missing from the db with the slant model
+INFERENCE_DEADLINE : float = 2.0 #seconds a watch waits for inferred slants
+INFERENCE_BATCH_SIZE : int = 200
+SLANT_CACHE_SIZE : int = 100_000 #inferred slants kept in memory
+BLOCK_ASSETS : bool = True #block thumbnails, fonts, ads and qoe telemetry during watches
+MAX_QUALITY : int = 144 #preferred player resolution when blocking assets
+WARM_START : bool = True #seed new puppet sessions from the consented template, see puppet.warm_start
+RECORD_GRAPH : bool = True #add every watch's recommendation edges to the graph store
+GRAPH_FLUSH_WATCHES : int = 200 #watches aggregated in memory between graph writes
 
 ROOT = Path(__file__).parents[1]
 
 load_dotenv(ROOT / ".env")
-API_KEY = json.loads(os.environ.get("API_KEY")) #YT Data API Key
+#API_KEY, the YT Data API keys, is parsed from the environment on first use, see __getattr__
 MAX_API_ERRORS : int = 5
+API_QUOTA_UNITS : int = 10_000 #daily quota per key
+API_WORKERS : int = 8 #parallel metadata requests
+API_CHUNK_SIZE : int = 50 #ids per videos.list call, at most 50
+VIDEOS_ENDPOINT = os.environ.get("VIDEOS_ENDPOINT", "https://www.googleapis.com/youtube/v3/videos")
 
 DB_DIR = ROOT / "data" / "db"
 DB_PATH = DB_DIR / "db.sqlite"
+COMPRESS_DESCRIPTIONS : bool = True #zlib descriptions in the compact video layout
+TRAJECTORY_DB_PATH = DB_DIR / "trajectories.sqlite"
+GRAPH_DB_PATH = DB_DIR / "graph.sqlite"
 
 SESSION_DIR = ROOT / "data" / "session"
 LOG_DIR = ROOT / "data" / "logs"
@@ -23,14 +44,23 @@ UBLOCK_PATH = ROOT / "src" / "puppet" / "extensions"
 SLANT_DIR = ROOT / "data" / "slant"
 SLANT_ESTIMATIONS_CSV = SLANT_DIR / "slant_estimations.csv"
 
-if not SESSION_DIR.exists():
-    os.mkdir(SESSION_DIR)
+MODEL_DIR = ROOT / "data" / "models"
+SLANT_MODEL_PATH = MODEL_DIR / "slant_model.joblib"
 
-if not DB_DIR.exists():
-    os.mkdir(DB_DIR)
+DATA_DIRS = [SESSION_DIR, DB_DIR, LOG_DIR, PUPPETS_DIR, UBLOCK_PATH]
 
-if not LOG_DIR.exists():
-    os.mkdir(LOG_DIR)
 
-if not UBLOCK_PATH.exists():
-    os.mkdir(UBLOCK_PATH)
\ No newline at end of file
+def init():
+    """ Create the data dirs. Called by entry points, importing config has no side effects """
+    for path in DATA_DIRS:
+        path.mkdir(parents=True, exist_ok=True)
+
+
+def __getattr__(name):
+    if name == "API_KEY":
+        raw = os.environ.get("API_KEY")
+        if raw is None:
+            raise RuntimeError("API_KEY is not set, add a JSON list of keys to the environment or .env")
+        globals()["API_KEY"] = json.loads(raw)
+        return globals()["API_KEY"]
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1 +1,2 @@
-from .db import get_videos, get_video, update_videos
\ No newline at end of file
+from .db import get_videos, get_video, get_videos_by_ids, update_videos
+from . import async_db
\ No newline at end of file
@@ -0,0 +1,48 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from models import Video
+from . import db
+from .slant_index import ExclusionSet
+
+# sqlite serialises writers anyway, so one dedicated thread keeps every query off the event loop
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-worker")
+
+
+async def run(fn, *args, **kwargs):
+    """Run a blocking db call on the db worker thread"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, partial(fn, *args, **kwargs))
+
+
+async def get_video(id : str) -> Video | None:
+    return await run(db.get_video, id)
+
+
+async def get_videos_by_ids(ids : list[str]) -> list[Video]:
+    return await run(db.get_videos_by_ids, ids)
+
+
+async def get_slants(ids : list[str]) -> dict[str, float | None]:
+    return await run(db.get_slants, ids)
+
+
+async def get_videos(slant_range : tuple[float,float], exclude : list[str] | ExclusionSet = [], n = 0, exclude_blacklist=True) -> list[Video]:
+    return await run(db.get_videos, slant_range, exclude=exclude, n=n, exclude_blacklist=exclude_blacklist)
+
+
+async def get_nearest_video(slant : float, exclude : ExclusionSet | None = None) -> Video | None:
+    return await run(db.get_nearest_video, slant, exclude)
+
+
+async def new_exclusion(ids : list[str] = []) -> ExclusionSet:
+    return await run(db.new_exclusion, ids)
+
+
+async def update_videos(vids : list[Video]):
+    return await run(db.update_videos, vids)
+
+
+def shutdown():
+    _executor.shutdown(wait=True)
@@ -0,0 +1,116 @@
+import argparse
+import asyncio
+import logging
+import random
+import sqlite3
+import time
+
+import numpy as np
+
+from . import db, async_db
+from models import Video
+import config
+
+RECS_PER_WATCH = 20
+
+
+def percentiles(samples : list[float]) -> str:
+    p50, p95 = np.percentile(samples, [50, 95]) if samples else (0, 0)
+    return f"p50 {p50 * 1000:.1f}ms, p95 {p95 * 1000:.1f}ms, max {max(samples, default=0) * 1000:.1f}ms"
+
+
+def connect_per_call(ids : list[str]) -> list[Video]:
+    """ The lookups before the pool: one get_video per rec, each on a new connection """
+    vids = []
+    for id in ids:
+        con = sqlite3.connect(config.DB_PATH, detect_types=sqlite3.PARSE_DECLTYPES)
+        with con:
+            row = con.execute("SELECT * FROM video WHERE id = ?", (id,)).fetchone()
+        con.close()
+        if row is not None: vids.append(Video(*row))
+    return vids
+
+
+def pooled_per_call(ids : list[str]) -> list[Video]:
+    return [vid for vid in map(db.get_video, ids) if vid is not None]
+
+
+def bench_lookups(watches : int, seed=0):
+    """ Per-watch latency of resolving a recommendation list: connection per get_video, pooled get_video, one get_videos_by_ids """
+    ids = [row[0] for row in db.get_connection().execute("SELECT id FROM video")]
+    rng = random.Random(seed)
+    lists = [rng.sample(ids, RECS_PER_WATCH) for _ in range(watches)]
+
+    for name, lookup in (("connection per get_video", connect_per_call), ("pooled get_video", pooled_per_call), ("get_videos_by_ids", db.get_videos_by_ids)):
+        times = []
+        for recs in lists:
+            start = time.perf_counter()
+            lookup(recs)
+            times.append(time.perf_counter() - start)
+        print(f"{name}: {watches} watches of {RECS_PER_WATCH} recs, {percentiles(times)}")
+
+
+async def probe(stop : asyncio.Event, interval : float) -> list[float]:
+    """ Event loop lag: how late a sleep of interval seconds wakes up, sampled until stop is set """
+    lags = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+    return lags
+
+
+async def hammer(ids : list[str], watches : int, blocking : bool, seed : int):
+    """ One fake puppet: a recommendation lookup per watch and a write-back every few watches """
+    rng = random.Random(seed)
+    for i in range(watches):
+        recs = rng.sample(ids, RECS_PER_WATCH)
+        if blocking:
+            vids = db.get_videos_by_ids(recs)
+            if i % 5 == 0: db.update_videos(vids[:1])
+            await asyncio.sleep(0) # hand the loop to the other puppets, as an awaited driver call would
+        else:
+            vids = await async_db.get_videos_by_ids(recs)
+            if i % 5 == 0: await async_db.update_videos(vids[:1])
+
+
+async def lag(puppets : int, watches : int, blocking : bool, interval : float = 0.005) -> tuple[float, list[float]]:
+    """ Run puppets fake puppets against the db while probing the loop. Returns wall time and lag samples """
+    ids = [row[0] for row in db.get_connection().execute("SELECT id FROM video")]
+    stop = asyncio.Event()
+    prober = asyncio.create_task(probe(stop, interval))
+
+    start = time.perf_counter()
+    await asyncio.gather(*[hammer(ids, watches, blocking, seed) for seed in range(puppets)])
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    return elapsed, await prober
+
+
+def bench_lag(puppets : int, watches : int):
+    """ Loop lag with the queries run on the loop versus on the db worker thread """
+    for name, blocking in (("blocking", True), ("async_db", False)):
+        elapsed, lags = asyncio.run(lag(puppets, watches, blocking))
+        print(f"{name}: {puppets * watches / elapsed:.0f} watches/s, loop lag {percentiles(lags)}")
+    async_db.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Database access benchmarks")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p_lookups = sub.add_parser("lookups", help="per-watch latency of recommendation lookups")
+    p_lookups.add_argument("--watches", type=int, default=1000)
+
+    p_lag = sub.add_parser("lag", help="event loop lag while fake puppets hammer the db, blocking calls versus async_db")
+    p_lag.add_argument("--puppets", type=int, default=50)
+    p_lag.add_argument("--watches", type=int, default=40, help="lookups per puppet")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    db.init()
+    if args.cmd == "lookups":
+        bench_lookups(args.watches)
+    else:
+        bench_lag(args.puppets, args.watches)
@@ -1,7 +1,16 @@
 import sqlite3
-from dataclasses import astuple, asdict
+import threading
+import hashlib
+import json
+import os
+import time
+import zlib
+from itertools import chain
+from pathlib import Path
+from dataclasses import asdict
 from models import Video
-import pandas as pd
+from .slant_index import SlantIndex, ExclusionSet
+import numpy as np
 import logging
 
 import config
@@ -12,30 +21,265 @@ CREATE TABLE IF NOT EXISTS video (
   slant REAL,
   title TEXT,
   channel TEXT,
-  description TEXT,
-  tags TAGLIST,
+  description ZTEXT,
+  tags TAGIDS,
   category TEXT,
   blacklist INTEGER DEFAULT 0
 );
 
 CREATE INDEX IF NOT EXISTS ix_video_slant ON video(slant);
 CREATE INDEX IF NOT EXISTS ix_video_channel ON video(channel);
+CREATE INDEX IF NOT EXISTS ix_video_id_slant ON video(id, slant, blacklist);
+
+CREATE TABLE IF NOT EXISTS tag (
+  id INTEGER PRIMARY KEY,
+  name TEXT NOT NULL UNIQUE
+);
+
+CREATE TABLE IF NOT EXISTS crawl (
+  id TEXT PRIMARY KEY,
+  status TEXT NOT NULL DEFAULT 'pending',
+  attempts INTEGER NOT NULL DEFAULT 0,
+  last_error TEXT,
+  fetched_at REAL
+);
+
+CREATE INDEX IF NOT EXISTS ix_crawl_status ON crawl(status);
+
+CREATE TABLE IF NOT EXISTS slant_cache (
+  id TEXT PRIMARY KEY,
+  slant REAL,
+  model_version TEXT,
+  confidence REAL,
+  created_at REAL
+);
+
+CREATE TABLE IF NOT EXISTS meta (
+  key TEXT PRIMARY KEY,
+  value TEXT
+);
 """
 
+CSV_CHUNK_SIZE = 100_000
+CSV_META_KEY = "slant_csv"
+
+STATEMENT_CACHE_SIZE = 256
+ID_BATCH_SIZE = 900 # stay below sqlite's default host parameter limit
+
+TAG_DTYPE = np.dtype("<u4")
+ZTEXT_MARKER = b"\x00z" # prefix of compressed text, plain text never starts with a NUL
+ZLIB_LEVEL = 6
+
+
+class ConnectionPool():
+    """Thread-safe pool handing out one persistent connection per thread"""
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections : list[sqlite3.Connection] = []
+
+
+    def get(self) -> sqlite3.Connection:
+        con = getattr(self._local, "con", None)
+        if con is None:
+            Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+            con = sqlite3.connect(
+                self.path,
+                detect_types=sqlite3.PARSE_DECLTYPES,
+                cached_statements=STATEMENT_CACHE_SIZE, # prepared statement reuse
+                timeout=30,
+            )
+            con.execute("PRAGMA journal_mode=WAL") # readers don't block the writer
+            con.execute("PRAGMA synchronous=NORMAL")
+            self._local.con = con
+            with self._lock:
+                self._connections.append(con)
+        return con
+
+
+    def close(self):
+        with self._lock:
+            for con in self._connections:
+                con.close()
+            self._connections.clear()
+        self._local = threading.local()
+
+
+pool = ConnectionPool(config.DB_PATH)
+
 
 def get_connection():
-    return sqlite3.connect(config.DB_PATH, detect_types=sqlite3.PARSE_DECLTYPES)
+    return pool.get()
+
+
+_index : SlantIndex | None = None
+_index_lock = threading.Lock()
+
+
+def get_slant_index() -> SlantIndex:
+    """ Load the slant index once per process """
+    global _index
+    with _index_lock:
+        if _index is None:
+            logger.info("Loading slant index...")
+            _index = SlantIndex.from_connection(get_connection())
+        return _index
+
+
+def invalidate_slant_index():
+    global _index
+    with _index_lock:
+        _index = None
+
+
+class TagDictionary():
+    """Process-wide cache of the tag table. Videos store their tags as packed ids into it"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._names : dict[int, str] = {}
+        self._ids : dict[str, int] = {}
+        self._max = 0
+
+
+    def _load(self, con : sqlite3.Connection):
+        for id, name in con.execute("SELECT id, name FROM tag WHERE id > ?", (self._max,)):
+            self._names[id] = name
+            self._ids[name] = id
+            self._max = max(self._max, id)
+
+
+    def register(self, con : sqlite3.Connection, names):
+        """ Add unknown tag names. Committed on their own so a failed video write can't orphan cached ids """
+        with self._lock:
+            missing = [name for name in dict.fromkeys(names) if name not in self._ids]
+            if not missing:
+                return
+            with con:
+                con.executemany("INSERT OR IGNORE INTO tag (name) VALUES (?)", [(name,) for name in missing])
+            self._load(con)
+
+
+    def encode(self, tags : list[str]) -> bytes:
+        return np.array([self._ids[tag] for tag in tags], dtype=TAG_DTYPE).tobytes()
+
+
+    def decode(self, data : bytes) -> list[str]:
+        ids = np.frombuffer(data, dtype=TAG_DTYPE).tolist()
+        with self._lock:
+            if any(id not in self._names for id in ids): # added by another process
+                self._load(get_connection())
+            return [self._names[id] for id in ids]
+
+
+    def clear(self):
+        with self._lock:
+            self._names.clear()
+            self._ids.clear()
+            self._max = 0
+
+
+tag_dictionary = TagDictionary()
+
+_compact : bool | None = None
+
+
+def video_layout(con : sqlite3.Connection) -> str | None:
+    """ Declared type of video.tags, TAGIDS for the compact layout and TAGLIST for the legacy one """
+    row = con.execute("SELECT type FROM pragma_table_info('video') WHERE name = 'tags'").fetchone()
+    return row[0] if row is not None else None
+
+
+def is_compact() -> bool:
+    global _compact
+    if _compact is None:
+        _compact = video_layout(get_connection()) == "TAGIDS"
+    return _compact
+
+
+def pack_text(text : str | None) -> str | bytes | None:
+    """ zlib compress text when it pays off """
+    if text is None or not config.COMPRESS_DESCRIPTIONS:
+        return text
+    raw = text.encode()
+    packed = zlib.compress(raw, ZLIB_LEVEL)
+    return ZTEXT_MARKER + packed if len(packed) + len(ZTEXT_MARKER) < len(raw) else text
+
+
+def unpack_text(data : bytes) -> str:
+    if data.startswith(ZTEXT_MARKER):
+        return zlib.decompress(data[len(ZTEXT_MARKER):]).decode()
+    return data.decode()
+
+
+def encode_videos(vids : list[Video]) -> list[dict]:
+    """ Column values for video rows in the layout of the open db """
+    rows = [asdict(vid) for vid in vids]
+    if not is_compact():
+        return rows # tags go through the comma joining list adapter
 
+    con = get_connection()
+    tag_dictionary.register(con, chain.from_iterable(row["tags"] or [] for row in rows))
+    for row in rows:
+        row["tags"] = tag_dictionary.encode(row["tags"]) if row["tags"] is not None else None
+        row["description"] = pack_text(row["description"])
+    return rows
 
-def build_db():
+
+def get_meta(con : sqlite3.Connection, key : str):
+    row = con.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return json.loads(row[0]) if row is not None else None
+
+
+def set_meta(con : sqlite3.Connection, key : str, value):
+    con.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+
+
+def file_hash(path) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def build_db(force=False):
+    """ Import the slant CSV. Skipped when the CSV is unchanged since the last import """
+    con = get_connection()
+    con.executescript(SCHEMA)
+    if not is_compact():
+        logger.warning("Legacy video layout, tags with commas are split on read. Convert with: python -m data_fetcher.migrate")
+
+    stat = os.stat(config.SLANT_ESTIMATIONS_CSV)
+    fingerprint = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    imported = get_meta(con, CSV_META_KEY)
+
+    if not force and imported is not None:
+        if all(imported.get(k) == v for k, v in fingerprint.items()):
+            return # cheap path, no read of the CSV at all
+
+        fingerprint["sha1"] = file_hash(config.SLANT_ESTIMATIONS_CSV)
+        if imported.get("sha1") == fingerprint["sha1"]: # touched but unchanged
+            with con:
+                set_meta(con, CSV_META_KEY, fingerprint)
+            return
+
+    fingerprint.setdefault("sha1", file_hash(config.SLANT_ESTIMATIONS_CSV))
     logger.info("Building database...")
 
-    with get_connection() as con:
-        con.executescript(SCHEMA)
+    import pandas as pd
+
+    chunks = pd.read_csv(
+        config.SLANT_ESTIMATIONS_CSV,
+        usecols=["video_id", "slant"],
+        dtype={"video_id": str, "slant": float},
+        chunksize=CSV_CHUNK_SIZE,
+    )
 
-        df = pd.read_csv(config.SLANT_ESTIMATIONS_CSV)
-        ids = df["video_id"]
-        slants = df["slant"]
+    with con: # single transaction, slant indexes rebuilt once at the end
+        con.execute("BEGIN")
+        con.execute("DROP INDEX IF EXISTS ix_video_slant")
+        con.execute("DROP INDEX IF EXISTS ix_video_id_slant")
 
         #build from CSV if IDs dont exist
         con.executemany("""
@@ -43,26 +287,34 @@ def build_db():
                 (id, slant)
             VALUES (?, ?)
             """,
-            zip(ids, slants)
+            chain.from_iterable(chunk.itertuples(index=False, name=None) for chunk in chunks)
         )
 
+        con.execute("CREATE INDEX IF NOT EXISTS ix_video_slant ON video(slant)")
+        con.execute("CREATE INDEX IF NOT EXISTS ix_video_id_slant ON video(id, slant, blacklist)")
+        set_meta(con, CSV_META_KEY, fingerprint)
+
 
 def insert_video(vid : Video):
     logger.info(f"Adding video {vid.id}...")
 
+    row = encode_videos([vid])[0]
     with get_connection() as con:
         con.execute("""
             INSERT INTO video
             (id, slant, title, channel, description, tags, category, blacklist)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            VALUES (:id, :slant, :title, :channel, :description, :tags, :category, :blacklist)
             """,
-            astuple(vid)
+            row
         )    
 
+    invalidate_slant_index() # new row, reload on next sample
+
 
 def update_videos(vids : list[Video]):
     logger.info(f"Updating {len(vids)} videos...")
 
+    rows = encode_videos(vids)
     with get_connection() as con:
         con.executemany("""
             UPDATE video                   
@@ -75,9 +327,13 @@ def update_videos(vids : list[Video]):
                 blacklist = :blacklist
             WHERE id = :id 
             """,
-            [asdict(vid) for vid in vids]
+            rows
         )
 
+    if _index is not None: # keep index in sync with blacklist flags
+        _index.set_blacklist([vid.id for vid in vids if vid.blacklist], True)
+        _index.set_blacklist([vid.id for vid in vids if not vid.blacklist], False)
+
 
 def get_video(id : str):
     logger.info(f"Fetching video {id}...")
@@ -90,14 +346,60 @@ def get_video(id : str):
         return None
 
 
-def get_videos(slant_range : tuple[float,float], exclude : list[str] = [], n = 0, exclude_blacklist=True) -> list[Video]:
+def get_videos_by_ids(ids : list[str]) -> list[Video]:
+    """ Return videos for a list of ids in one query per batch. Ids missing from the db are skipped """
+    logger.info(f"Fetching {len(ids)} videos by id...")
+
+    ids = list(dict.fromkeys(ids)) # dedupe, keep order
+    vids = []
+
+    con = get_connection()
+    for i in range(0, len(ids), ID_BATCH_SIZE):
+        batch = ids[i:i+ID_BATCH_SIZE]
+        placeholders = ",".join("?" for x in batch)
+        rows = con.execute(f"SELECT * FROM video WHERE id IN ({placeholders})", batch)
+        vids.extend(Video(*row) for row in rows)
+
+    return vids
+
+
+def get_slants(ids : list[str]) -> dict[str, float | None]:
+    """ Slants for a list of ids, read from the covering (id, slant) index without touching the text columns """
+    ids = list(dict.fromkeys(ids))
+    slants = {}
+
+    con = get_connection()
+    for i in range(0, len(ids), ID_BATCH_SIZE):
+        batch = ids[i:i+ID_BATCH_SIZE]
+        placeholders = ",".join("?" for x in batch)
+        slants.update(con.execute(f"SELECT id, slant FROM video INDEXED BY ix_video_id_slant WHERE id IN ({placeholders})", batch)) # planner prefers the pk index without stats
+
+    return slants
+
+
+def get_videos(slant_range : tuple[float,float], exclude : list[str] | ExclusionSet = [], n = 0, exclude_blacklist=True) -> list[Video]:
     """ Return videos in slant range. Optionally exclude list of ids. Optionally define n videos to randomly sample """
 
     logger.info(f"Fetching videos in slant range {slant_range}...")
 
+    if n > 0: # sample from the in-memory index instead of ORDER BY RANDOM()
+        index = get_slant_index()
+        if isinstance(exclude, ExclusionSet):
+            exclude = exclude.rebase(index)
+        else:
+            exclude = index.exclusion(exclude) if exclude else None
+        ids = index.sample(slant_range, n, exclude=exclude, exclude_blacklist=exclude_blacklist)
+        vids = {v.id: v for v in get_videos_by_ids(ids)}
+        return [vids[id] for id in ids if id in vids]
+
     params = list(slant_range)
     sql = "SELECT * FROM video WHERE slant BETWEEN ? AND ?"
 
+    if isinstance(exclude, ExclusionSet):
+        with get_connection() as con:
+            rows = con.execute(sql + (" AND blacklist != 1" if exclude_blacklist else ""), params).fetchall()
+        return [Video(*row) for row in rows if row[0] not in exclude]
+
     if exclude:
         placeholders = ",".join("?" for x in exclude) # question marks
         sql += f" AND id NOT IN ({placeholders})"
@@ -106,16 +408,95 @@ def get_videos(slant_range : tuple[float,float], exclude : list[str] = [], n = 0
     if exclude_blacklist:
         sql += f" AND blacklist != 1"
 
-    if n > 0:
-        sql += " ORDER BY RANDOM() LIMIT ?"
-        params.append(n)
+    with get_connection() as con:
+        rows = con.execute(sql, params).fetchall()
+
+    return [Video(*row) for row in rows]
+
+
+def get_crawl_videos(refresh_older_than : float | None = None, max_attempts = 3) -> list[Video]:
+    """ Videos the metadata crawl still has to fetch: those without metadata that haven't failed max_attempts times.
+    Videos with metadata are only refetched when their last fetch is older than refresh_older_than seconds """
+    cutoff = time.time() - refresh_older_than if refresh_older_than is not None else None
+
+    sql = """
+        SELECT v.* FROM video v
+        LEFT JOIN crawl c ON c.id = v.id
+        WHERE v.slant BETWEEN -1 AND 1
+        AND v.blacklist != 1
+        AND (
+            (v.title IS NULL
+                AND COALESCE(c.status, 'pending') IN ('pending', 'error')
+                AND COALESCE(c.attempts, 0) < :max_attempts)
+            OR (:cutoff IS NOT NULL
+                AND COALESCE(c.fetched_at, 0) < :cutoff -- titled before the crawl table existed counts as never fetched
+                AND NOT (COALESCE(c.status, '') = 'error' AND c.attempts >= :max_attempts))
+        )
+    """
 
     with get_connection() as con:
-        rows = con.execute(sql, params)
+        rows = con.execute(sql, {"max_attempts": max_attempts, "cutoff": cutoff}).fetchall()
 
     return [Video(*row) for row in rows]
 
 
+def mark_crawled(ids : list[str], status : str, error : str | None = None):
+    """ Record a fetch attempt. status is done, missing or error """
+    with get_connection() as con:
+        con.executemany("""
+            INSERT INTO crawl (id, status, attempts, last_error, fetched_at)
+            VALUES (:id, :status, 1, :error, :now)
+            ON CONFLICT(id) DO UPDATE SET
+                status = excluded.status,
+                attempts = crawl.attempts + 1,
+                last_error = excluded.last_error,
+                fetched_at = CASE WHEN excluded.status = 'error' THEN crawl.fetched_at ELSE excluded.fetched_at END
+            """,
+            [{"id": id, "status": status, "error": error, "now": time.time()} for id in ids]
+        )
+
+
+def get_nearest_video(slant : float, exclude : ExclusionSet | None = None) -> Video | None:
+    """ Video with slant closest to the given slant, skipping blacklisted and excluded ones """
+    index = get_slant_index()
+    id = index.nearest(slant, exclude=exclude.rebase(index) if exclude is not None else None)
+    if id is None:
+        return None
+    vids = get_videos_by_ids([id])
+    return vids[0] if vids else None
+
+
+def get_cached_slants(ids : list[str], model_version : str) -> dict[str, float | None]:
+    """ Inferred slants cached for a model version. None marks a video the API had no metadata for """
+    ids = list(dict.fromkeys(ids))
+    cached = {}
+
+    con = get_connection()
+    for i in range(0, len(ids), ID_BATCH_SIZE):
+        batch = ids[i:i+ID_BATCH_SIZE]
+        placeholders = ",".join("?" for x in batch)
+        rows = con.execute(f"SELECT id, slant FROM slant_cache WHERE model_version = ? AND id IN ({placeholders})", [model_version, *batch])
+        cached.update(rows)
+
+    return cached
+
+
+def cache_slants(rows : list[tuple[str, float | None, float]], model_version : str):
+    """ Store (id, slant, confidence) rows inferred by a model version """
+    with get_connection() as con:
+        con.executemany("""
+            INSERT OR REPLACE INTO slant_cache (id, slant, model_version, confidence, created_at)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            [(id, slant, model_version, confidence, time.time()) for id, slant, confidence in rows]
+        )
+
+
+def new_exclusion(ids : list[str] = []) -> ExclusionSet:
+    """ Empty per-puppet exclusion bitset over the slant index """
+    return get_slant_index().exclusion(ids)
+
+
 def list_to_text(lst : list):
     return ",".join(lst)
 
@@ -141,7 +522,12 @@ logger = setup_logger()
 # tags adapter
 sqlite3.register_adapter(list, list_to_text)
 sqlite3.register_converter("TAGLIST", text_to_list)
+sqlite3.register_converter("TAGIDS", tag_dictionary.decode)
+sqlite3.register_converter("ZTEXT", unpack_text)
 
-build_db()
 
+def init(force=False):
+    """ Data dirs, schema and slant CSV import. Run once by entry points before the first query """
+    config.init()
+    build_db(force)
 
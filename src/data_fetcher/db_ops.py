@@ -1,24 +1,36 @@
-from .youtube_api import get_videos_metadata
-from .db import get_videos, update_videos
+from .youtube_api import fetch_metadata
+from . import db
+from .db import get_videos, get_crawl_videos, mark_crawled, update_videos
+import argparse
 import random
 
-def build_metadata():
-    """Fills db with metadata from the YouTube Data API"""
-    vids = get_videos((-1,1))
+import config
+
+def build_metadata(refresh_older_than : float | None = None, max_attempts = 3):
+    """Fills db with metadata from the YouTube Data API. Resumes from the crawl table, so reruns only fetch pending work"""
+    vids = get_crawl_videos(refresh_older_than=refresh_older_than, max_attempts=max_attempts)
     random.shuffle(vids)
 
     print(f"Building metadata for {len(vids)} videos")
 
-    chunks = [vids[i:i+49] for i in range(0, len(vids), 49)]
+    n_chunks = -(-len(vids) // config.API_CHUNK_SIZE)
+
+    for i, (chunk, result) in enumerate(fetch_metadata(vids)): # written as chunks complete
+        if isinstance(result, Exception):
+            mark_crawled([vid.id for vid in chunk], "error", error=str(result))
+            print(f"Chunk {i}/{n_chunks} failed: {result}")
+            continue
 
-    for i, chunk in enumerate(chunks):
-        vids_u = get_videos_metadata(chunk)
+        for vid in result.missing: #blacklist videos with no metadata
+            vid.blacklist = True
 
-        for vid in vids_u: #blacklist videos with no metadata
-            if vid.title is None: vid.blacklist = True
+        if result.unexpected:
+            print(f"Chunk {i}/{n_chunks} returned unexpected ids: {result.unexpected}")
 
-        update_videos(vids_u)
-        print(f"Updated chunk {i}/{len(chunks)}")
+        update_videos(result.videos + result.missing)
+        mark_crawled([vid.id for vid in result.videos], "done")
+        mark_crawled([vid.id for vid in result.missing], "missing")
+        print(f"Updated chunk {i}/{n_chunks}")
 
 
 def blacklist_empty(): 
@@ -30,4 +42,13 @@ def blacklist_empty():
 
 
 if __name__ == "__main__":
-    pass
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Crawl video metadata from the YouTube Data API")
+    parser.add_argument("--refresh-older-than", type=float, default=None, metavar="DAYS", help="also refetch videos with metadata fetched more than DAYS ago")
+    parser.add_argument("--max-attempts", type=int, default=3, help="give up on a video after this many failed fetches")
+    args = parser.parse_args()
+
+    db.init()
+    build_metadata(
+        refresh_older_than=args.refresh_older_than * 86400 if args.refresh_older_than is not None else None,
+        max_attempts=args.max_attempts,
+    )
@@ -0,0 +1,115 @@
+from . import db
+from .db import SCHEMA, TAG_DTYPE, pack_text, video_layout
+import argparse
+import os
+import random
+import sqlite3
+import time
+
+import numpy as np
+
+import config
+
+MIGRATE_CHUNK_SIZE = 10_000
+
+
+def db_size(path) -> int:
+    """ Bytes on disk including the WAL """
+    return sum(os.path.getsize(f"{path}{suffix}") for suffix in ("", "-wal") if os.path.exists(f"{path}{suffix}"))
+
+
+def migrate(path=config.DB_PATH, chunk_size=MIGRATE_CHUNK_SIZE):
+    """ Convert a legacy video table (comma joined tags, plain descriptions) to the compact layout. Reruns resume an interrupted copy """
+    con = sqlite3.connect(path) # no converters, legacy tags come back as raw text
+    try:
+        resuming = con.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'video_legacy'").fetchone() is not None
+        if not resuming:
+            if video_layout(con) != "TAGLIST":
+                print(f"{path} already uses the compact layout")
+                return False
+            with con:
+                con.execute("ALTER TABLE video RENAME TO video_legacy")
+                con.execute("DROP INDEX IF EXISTS ix_video_slant") # names are reused by the new table
+                con.execute("DROP INDEX IF EXISTS ix_video_channel")
+                con.execute("DROP INDEX IF EXISTS ix_video_id_slant")
+
+        con.executescript(SCHEMA)
+        tag_ids = dict((name, id) for id, name in con.execute("SELECT id, name FROM tag"))
+        next_id = max(tag_ids.values(), default=0) + 1
+
+        with con: # one transaction, a crash leaves video_legacy untouched
+            con.execute("BEGIN")
+            con.execute("DELETE FROM video") # rows of an interrupted run
+
+            rows = con.execute("SELECT id, slant, title, channel, description, tags, category, blacklist FROM video_legacy")
+            copied = 0
+            while batch := rows.fetchmany(chunk_size):
+                new_tags = []
+                out = []
+                for id, slant, title, channel, description, tags, category, blacklist in batch:
+                    if tags is not None:
+                        names = tags.split(",") if tags else [] # commas inside tags were lost when they were written
+                        for name in names:
+                            if name not in tag_ids:
+                                tag_ids[name] = next_id
+                                new_tags.append((next_id, name))
+                                next_id += 1
+                        tags = np.array([tag_ids[name] for name in names], dtype=TAG_DTYPE).tobytes()
+                    out.append((id, slant, title, channel, pack_text(description), tags, category, blacklist))
+
+                con.executemany("INSERT INTO tag (id, name) VALUES (?, ?)", new_tags)
+                con.executemany("INSERT INTO video VALUES (?, ?, ?, ?, ?, ?, ?, ?)", out)
+                copied += len(out)
+                print(f"Copied {copied} videos")
+
+            con.execute("DROP TABLE video_legacy")
+
+        con.execute("VACUUM")
+        con.execute("ANALYZE")
+        con.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        con.close()
+
+    return True
+
+
+def bench(n : int, seed=0):
+    """ Time full row and slant-only lookups of n random videos through the db module """
+    con = db.get_connection()
+    ids = [row[0] for row in con.execute("SELECT id FROM video")]
+    ids = random.Random(seed).sample(ids, min(n, len(ids)))
+
+    start = time.perf_counter()
+    db.get_videos_by_ids(ids)
+    rows_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    db.get_slants(ids)
+    slants_s = time.perf_counter() - start
+
+    print(f"{len(ids)} lookups: full rows {rows_s * 1000:.1f}ms, slants only {slants_s * 1000:.1f}ms")
+
+
+def reset():
+    """ Drop cached connections and layout state after the file was rewritten """
+    db.pool.close()
+    db.tag_dictionary.clear()
+    db.invalidate_slant_index()
+    db._compact = None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert db.sqlite to the compact video layout")
+    parser.add_argument("--bench", type=int, default=1000, help="random lookups timed before and after, 0 to skip")
+    args = parser.parse_args()
+
+    db.init()
+    size = db_size(config.DB_PATH)
+    print(f"Before: {size / 2**20:.1f} MiB")
+    if args.bench: bench(args.bench)
+
+    reset()
+    if migrate():
+        reset()
+        print(f"After: {db_size(config.DB_PATH) / 2**20:.1f} MiB")
+        if args.bench: bench(args.bench)
@@ -0,0 +1,141 @@
+import argparse
+import json
+import random
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+VIDEOS_PATH = "/youtube/v3/videos"
+
+
+class MockYouTubeAPI(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, quota : int = 10_000, latency : float = 0.0, missing_rate : float = 0.05):
+        super().__init__(address, MockHandler)
+        self.quota = quota
+        self.latency = latency
+        self.missing_rate = missing_rate
+        self.used : dict[str, int] = {}
+        self.requests = 0
+        self._lock = threading.Lock()
+
+
+    @property
+    def endpoint(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}{VIDEOS_PATH}"
+
+
+    def charge(self, key : str) -> bool:
+        with self._lock:
+            self.requests += 1
+            if self.used.get(key, 0) >= self.quota:
+                return False
+            self.used[key] = self.used.get(key, 0) + 1
+            return True
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    server : MockYouTubeAPI
+
+    def log_message(self, format, *args):
+        pass
+
+
+    def send_json(self, status : int, body : dict):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+
+        if url.path != VIDEOS_PATH:
+            return self.send_json(404, {"error": {"code": 404, "errors": [{"reason": "notFound"}]}})
+
+        key = params.get("key", [""])[0]
+        ids = [id for id in params.get("id", [""])[0].split(",") if id]
+        if not ids or len(ids) > 50:
+            return self.send_json(400, {"error": {"code": 400, "errors": [{"reason": "badRequest"}]}})
+        if not self.server.charge(key):
+            return self.send_json(403, {"error": {"code": 403, "errors": [{"reason": "quotaExceeded"}]}})
+
+        if self.server.latency: time.sleep(self.server.latency)
+
+        items = [
+            {
+                "id": id,
+                "snippet": {
+                    "title": f"Title {id}",
+                    "channelTitle": f"Channel {hash(id) % 100}",
+                    "description": f"Description of {id}",
+                    "categoryId": str(hash(id) % 30),
+                    "tags": [f"tag{hash(id) % 7}", f"tag{hash(id) % 11}"],
+                },
+            }
+            for id in ids if random.random() >= self.server.missing_rate # unavailable videos are dropped
+        ]
+        self.send_json(200, {"kind": "youtube#videoListResponse", "items": items})
+
+
+@contextmanager
+def serve(port : int = 0, **kwargs):
+    """Run the mock API in a background thread, yields the server"""
+    server = MockYouTubeAPI(("127.0.0.1", port), **kwargs)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def bench(n : int, keys : int, quota : int, latency : float, workers : int):
+    """Fetch metadata for n synthetic videos against the mock API"""
+    import config
+    from models import Video
+    from .youtube_api import KeyBudget, fetch_metadata
+
+    with serve(quota=quota, latency=latency) as server:
+        config.VIDEOS_ENDPOINT = server.endpoint
+        budget = KeyBudget([f"key-{i}" for i in range(keys)], units=quota)
+        vids = [Video(f"{i:011d}") for i in range(n)]
+
+        start = time.perf_counter()
+        fetched = 0
+        try:
+            for chunk, result in fetch_metadata(vids, workers=workers, budget=budget):
+                if not isinstance(result, Exception): fetched += len(result.videos)
+        except Exception as e:
+            print(f"Stopped: {e}")
+        elapsed = time.perf_counter() - start
+
+        print(f"Fetched {fetched}/{n} videos in {elapsed:.2f}s ({fetched / elapsed:.0f} videos/s)")
+        print(f"Requests: {server.requests}, quota used per key: {server.used}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock YouTube Data API videos endpoint")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--quota", type=int, default=10_000)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--bench", type=int, default=0, help="benchmark fetching n videos instead of serving")
+    parser.add_argument("--keys", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+
+    if args.bench:
+        bench(args.bench, args.keys, args.quota, args.latency, args.workers)
+    else:
+        with serve(args.port, quota=args.quota, latency=args.latency) as server:
+            print(f"Serving mock API on {server.endpoint}")
+            threading.Event().wait()
@@ -0,0 +1,143 @@
+import sqlite3
+import threading
+from typing import Iterable
+
+import numpy as np
+
+OVERSAMPLE = 4 # candidates drawn per wanted video before falling back to a full range scan
+
+
+class ExclusionSet():
+    """Bitset over slant index positions, e.g. the videos a puppet has already watched"""
+    def __init__(self, index : "SlantIndex"):
+        self.index = index
+        self.bits = np.zeros((len(index) + 7) // 8, dtype=np.uint8)
+
+
+    def add(self, id : str):
+        pos = self.index.position(id)
+        if pos is not None: self.bits[pos >> 3] |= np.uint8(1 << (pos & 7))
+
+
+    def update(self, ids : Iterable[str]):
+        for id in ids: self.add(id)
+
+
+    def contains(self, pos : np.ndarray) -> np.ndarray:
+        """Vectorised membership test for an array of positions"""
+        return ((self.bits[pos >> 3] >> (pos & 7).astype(np.uint8)) & 1).astype(bool)
+
+
+    def ids(self) -> list[str]:
+        bits = np.unpackbits(self.bits, bitorder="little")[:len(self.index)]
+        return list(self.index.ids[np.flatnonzero(bits)])
+
+
+    def rebase(self, index : "SlantIndex") -> "ExclusionSet":
+        """Same ids over a reloaded index"""
+        return self if index is self.index else index.exclusion(self.ids())
+
+
+    def __contains__(self, id : str):
+        pos = self.index.position(id)
+        return pos is not None and bool(self.contains(np.array([pos]))[0])
+
+
+class SlantIndex():
+    """In-memory video table sorted by slant, for fast range sampling without hitting sqlite"""
+    def __init__(self, ids : np.ndarray, slants : np.ndarray, blacklist : np.ndarray, seed=None):
+        order = np.argsort(slants, kind="stable")
+        self.ids = ids[order]
+        self.slants = slants[order]
+        self.blacklist = blacklist[order]
+        self._pos = {id: i for i, id in enumerate(self.ids)}
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+
+
+    @classmethod
+    def from_connection(cls, con : sqlite3.Connection, seed=None) -> "SlantIndex":
+        rows = con.execute("SELECT id, slant, blacklist FROM video WHERE slant IS NOT NULL").fetchall()
+        ids = np.array([r[0] for r in rows], dtype=object)
+        slants = np.fromiter((r[1] for r in rows), dtype=np.float64, count=len(rows))
+        blacklist = np.fromiter((r[2] == 1 for r in rows), dtype=bool, count=len(rows))
+        return cls(ids, slants, blacklist, seed=seed)
+
+
+    def __len__(self):
+        return len(self.ids)
+
+
+    def position(self, id : str) -> int | None:
+        return self._pos.get(id)
+
+
+    def exclusion(self, ids : Iterable[str] = ()) -> ExclusionSet:
+        ex = ExclusionSet(self)
+        ex.update(ids)
+        return ex
+
+
+    def range(self, slant_range : tuple[float,float]) -> slice:
+        """Positions with slant in the closed interval, found by binary search"""
+        lo, hi = slant_range
+        start = np.searchsorted(self.slants, lo, side="left")
+        stop = np.searchsorted(self.slants, hi, side="right")
+        return slice(int(start), int(max(start, stop)))
+
+
+    def _valid(self, pos : np.ndarray, exclude : ExclusionSet | None, exclude_blacklist : bool) -> np.ndarray:
+        mask = np.ones(len(pos), dtype=bool)
+        if exclude_blacklist: mask &= ~self.blacklist[pos]
+        if exclude is not None: mask &= ~exclude.contains(pos)
+        return mask
+
+
+    def sample(self, slant_range : tuple[float,float], n : int, exclude : ExclusionSet | None = None, exclude_blacklist=True) -> list[str]:
+        """ Uniformly sample up to n ids in slant range without replacement """
+        rng = self.range(slant_range)
+        size = rng.stop - rng.start
+        if size == 0 or n <= 0:
+            return []
+
+        with self._lock:
+            # cheap path: draw a few candidates and drop the ineligible ones
+            k = min(size, n * OVERSAMPLE)
+            pos = rng.start + self._rng.choice(size, size=k, replace=False)
+            pos = pos[self._valid(pos, exclude, exclude_blacklist)]
+            if len(pos) >= n or k == size:
+                return list(self.ids[pos[:n]])
+
+            # dense exclusions: scan the whole range once
+            pos = np.arange(rng.start, rng.stop)
+            pos = pos[self._valid(pos, exclude, exclude_blacklist)]
+            pos = self._rng.choice(pos, size=min(n, len(pos)), replace=False)
+            return list(self.ids[pos])
+
+
+    def nearest(self, slant : float, exclude : ExclusionSet | None = None, exclude_blacklist=True) -> str | None:
+        """ Return the id with slant closest to the given slant """
+        if len(self) == 0:
+            return None
+
+        center = int(np.searchsorted(self.slants, slant))
+        width = 16
+        while True:
+            start, stop = max(0, center - width), min(len(self), center + width)
+            pos = np.arange(start, stop)
+            pos = pos[self._valid(pos, exclude, exclude_blacklist)]
+            if len(pos) > 0:
+                best = pos[np.argmin(np.abs(self.slants[pos] - slant))]
+                # a closer candidate can only sit outside the window if the window was clipped on neither side
+                dist = abs(self.slants[best] - slant)
+                if (start == 0 or slant - self.slants[start] >= dist) and (stop == len(self) or self.slants[stop-1] - slant >= dist):
+                    return self.ids[best]
+            if start == 0 and stop == len(self):
+                return None
+            width *= 2
+
+
+    def set_blacklist(self, ids : Iterable[str], flag : bool = True):
+        for id in ids:
+            pos = self._pos.get(id)
+            if pos is not None: self.blacklist[pos] = flag
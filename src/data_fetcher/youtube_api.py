@@ -1,87 +1,201 @@
 import requests
+from requests.adapters import HTTPAdapter
 from time import sleep
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Iterable, Iterator
+from dataclasses import dataclass
+import threading
+import random
 
 import config
 from models import Video
 
 from itertools import islice
-from youtube_comment_downloader import *
-from youtube_transcript_api import YouTubeTranscriptApi
 import time
 
-VIDEOS_ENDPOINT : str = "https://www.googleapis.com/youtube/v3/videos"
+VIDEOS_LIST_COST : int = 1 #quota units per videos.list call
+BACKOFF_BASE : float = 1.0
+BACKOFF_CAP : float = 60.0
+QUOTA_REASONS = {"quotaExceeded", "dailyLimitExceeded"}
 
-api_index : int = 0
-error_counter : int = 0 
 
+class QuotaExceededException(Exception):
+    def __init__(self):
+        super().__init__("Quota exceeded.")
 
-def request(url : str, params : dict):
-    global api_index, error_counter
+
+class KeyBudget():
+    """Thread-safe tracker of remaining quota units per API key"""
+    def __init__(self, keys : list[str], units : int = config.API_QUOTA_UNITS):
+        self.remaining = {key: units for key in keys}
+        self._lock = threading.Lock()
+
+
+    def acquire(self, cost : int) -> str:
+        """Charge cost units to the key with most budget left"""
+        with self._lock:
+            key = max(self.remaining, key=self.remaining.get)
+            if self.remaining[key] < cost:
+                raise QuotaExceededException()
+            self.remaining[key] -= cost
+            return key
+
+
+    def exhaust(self, key : str):
+        with self._lock:
+            self.remaining[key] = 0
+
+
+    def total(self) -> int:
+        with self._lock:
+            return sum(self.remaining.values())
+
+
+_budget : KeyBudget | None = None
+_local = threading.local()
+
+
+def get_budget() -> KeyBudget:
+    global _budget
+    if _budget is None:
+        _budget = KeyBudget(config.API_KEY)
+    return _budget
+
+
+def get_session() -> requests.Session:
+    """Keep-alive session per thread"""
+    session = getattr(_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        session.mount("https://", HTTPAdapter(pool_maxsize=config.API_WORKERS))
+        session.mount("http://", HTTPAdapter(pool_maxsize=config.API_WORKERS))
+        _local.session = session
+    return session
+
+
+def backoff(attempt : int):
+    """Full-jitter exponential backoff"""
+    sleep(random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt)))
+
+
+def error_reason(resp : requests.Response) -> str | None:
     try:
-        resp = requests.get(url, params=params)
-        resp.raise_for_status()
-        if resp:
-            error_counter = 0
-            return resp.json()
-        else:
-            print("No response.")
-            return
-    except requests.HTTPError as e:
-        print("HTTP error...")
-        status = e.response.status_code
-        if status == 403:
-            print(f"API index {api_index} reached quota.")
-            if (api_index + 1 < len(config.API_KEY)):
-                api_index += 1
-                params.update({"key": config.API_KEY[api_index]})
-                request(url, params)
-            else:
-                raise Exception("Quota exceeded.")
-        if status == 400:
-            print("Bad request.")
-            return
-    except (requests.Timeout, requests.ConnectionError):
-        print("Connection error. Trying again in 5 seconds...")
-        sleep(5)
-        if error_counter <= config.MAX_API_ERRORS:
-            request(url, params)
-            error_counter += 1
+        return resp.json()["error"]["errors"][0]["reason"]
+    except (ValueError, KeyError, IndexError, TypeError):
+        return None
+
+
+def request(url : str, params : dict, budget : KeyBudget | None = None, cost : int = VIDEOS_LIST_COST):
+    budget = budget or get_budget()
+    errors = 0
+
+    while True:
+        key = budget.acquire(cost) # raises once every key is spent
+        try:
+            resp = get_session().get(url, params={**params, "key": key}, timeout=30)
+        except (requests.Timeout, requests.ConnectionError):
+            print("Connection error. Backing off...")
+            errors += 1
         else:
+            if resp.ok:
+                return resp.json()
+
+            status = resp.status_code
+            if status == 400:
+                print("Bad request.")
+                return
+            if status == 403 and error_reason(resp) != "rateLimitExceeded":
+                print(f"API key ...{key[-4:]} reached quota.")
+                budget.exhaust(key)
+                continue
+            print(f"HTTP error {status}. Backing off...")
+            errors += 1
+
+        if errors > config.MAX_API_ERRORS:
             raise Exception("Max errors reached.")
+        backoff(errors)
+
+
+@dataclass(slots=True)
+class MetadataResult():
+    videos : list[Video] # requested videos the API returned
+    missing : list[Video] # requested but not returned, i.e. deleted, private or invalid
+    unexpected : list[str] # returned ids that were never requested
 
 
-def get_videos_metadata(vids : list[Video]) -> list[Video]:
+def parse_items(items : Iterable[dict], requested : dict[str, Video]) -> Iterator[Video | str]:
+    """Yield a Video per requested item, or the bare id of an unexpected one"""
+    for item in items:
+        vid = requested.get(item.get("id"))
+        if vid is None:
+            yield item.get("id")
+            continue
+
+        snippet = item.get("snippet", {})
+        yield Video(
+            id=vid.id,
+            slant=vid.slant,
+            channel=snippet.get("channelTitle"),
+            title=snippet.get("title"),
+            description=snippet.get("description"),
+            category=snippet.get("categoryId"),
+            tags=snippet.get("tags", [])
+        )
+
+
+def get_videos_metadata(vids : list[Video], budget : KeyBudget | None = None) -> MetadataResult:
     if len(vids) > 50: #split list 
         raise Exception("API can only process 50 videos at a time.")
 
-    video_resp = request(VIDEOS_ENDPOINT, params = {
-        "key": config.API_KEY[api_index],
+    video_resp = request(config.VIDEOS_ENDPOINT, params = {
         "part": "contentDetails, snippet, statistics",
         "id": ",".join([vid.id for vid in vids])
-    })
-
-    if not "items" in video_resp:
-        print("No items in response")
-        return
-    
-    vids = [
-        Video(
-            id=item["id"],
-            slant=next((v for v in vids if v.id == item["id"]), None).slant,
-            channel=item["snippet"]["channelTitle"],
-            title=item["snippet"]["title"],
-            description=item["snippet"].get("description", None),
-            category=item["snippet"].get("categoryId", None),
-            tags=item["snippet"].get("tags", [])
-        ) 
-        for item in video_resp["items"]
-    ]
-
-    return vids
+    }, budget=budget)
+
+    if video_resp is None:
+        raise Exception("Bad request.")
+
+    requested = {vid.id: vid for vid in vids}
+    result = MetadataResult([], [], [])
+
+    for parsed in parse_items(video_resp.get("items", []), requested):
+        if isinstance(parsed, Video): result.videos.append(parsed)
+        else: result.unexpected.append(parsed)
+
+    returned = {vid.id for vid in result.videos}
+    result.missing = [vid for vid in vids if vid.id not in returned]
+    return result
+
+
+def fetch_metadata(vids : list[Video], chunk_size : int = config.API_CHUNK_SIZE, workers : int = config.API_WORKERS, budget : KeyBudget | None = None) -> Iterator[tuple[list[Video], MetadataResult | Exception]]:
+    """Fetch metadata for many videos in parallel, yielding (chunk, result) as each chunk completes.
+    A failed chunk yields its exception, running out of quota stops the whole fetch"""
+    budget = budget or get_budget()
+    chunks = (vids[i:i+chunk_size] for i in range(0, len(vids), chunk_size))
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="yt-api") as pool:
+        pending = {pool.submit(get_videos_metadata, chunk, budget): chunk for chunk in islice(chunks, workers * 2)} # bounded in-flight window
+
+        try:
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    chunk = pending.pop(future)
+                    exc = future.exception()
+                    if isinstance(exc, QuotaExceededException):
+                        raise exc
+                    yield chunk, exc or future.result()
+
+                    chunk = next(chunks, None)
+                    if chunk is not None: pending[pool.submit(get_videos_metadata, chunk, budget)] = chunk
+        finally:
+            for future in pending: future.cancel()
 
 
 def get_comments(id : str, n = 10, wait = 0):
     """Get top n comments from video ID"""
+    from youtube_comment_downloader import YoutubeCommentDownloader, SORT_BY_POPULAR # slow to import, only the scrapers need it
+
     if wait > 0: time.sleep(wait)
 
     downloader = YoutubeCommentDownloader()
@@ -96,6 +210,8 @@ def get_comments(id : str, n = 10, wait = 0):
 
 def get_transcript(id : str, wait = 0):
     """Get transcript from video ID"""
+    from youtube_transcript_api import YouTubeTranscriptApi
+
     ytt_api = YouTubeTranscriptApi()
     if wait > 0: time.sleep(wait)
 
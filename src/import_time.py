@@ -0,0 +1,55 @@
+import argparse
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+MODULES = ["config", "data_fetcher", "puppet", "supervisor", "classifier.inference", "analysis"]
+HEAVY = ["pandas", "sklearn", "scipy", "joblib", "youtube_comment_downloader", "youtube_transcript_api"] #only loaded by the code paths that need them
+
+
+def import_times(module : str) -> dict[str, tuple[int, int]]:
+    """ Self and cumulative microseconds of every module imported by a fresh interpreter importing module """
+    env = {k: v for k, v in os.environ.items() if k != "API_KEY"} # importing must not need the key
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                          cwd=Path(__file__).parent, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr[-2000:]}")
+
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        times[name.strip()] = (int(own), int(cumulative))
+    return times
+
+
+def bench(modules : list[str], runs : int, top : int) -> dict[str, float]:
+    """ Best of runs cold import time per module in ms, with the heavy dependencies each one pulls in """
+    result = {}
+    for module in modules:
+        samples = [import_times(module) for _ in range(runs)]
+        best = min(samples, key=lambda t: t[module][1])
+        result[module] = best[module][1] / 1000
+
+        heavy = [name for name in HEAVY if name in best]
+        print(f"{module}: {result[module]:.1f} ms" + (f", loads {', '.join(heavy)}" if heavy else ""))
+        for name, (own, _) in sorted(best.items(), key=lambda x: -x[1][0])[:top]:
+            print(f"  {own / 1000:8.1f} ms  {name}")
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cold import time of the entry modules, see python -X importtime")
+    parser.add_argument("modules", nargs="*", default=MODULES)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=5, help="slowest imports listed per module")
+    parser.add_argument("--budget", type=float, default=None, help="exit non-zero when a module takes longer, in ms")
+    args = parser.parse_args()
+
+    times = bench(args.modules, args.runs, args.top)
+    if args.budget is not None:
+        over = [m for m, ms in times.items() if ms > args.budget]
+        if over:
+            sys.exit(f"Over the {args.budget:.0f} ms budget: {', '.join(over)}")
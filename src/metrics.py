@@ -0,0 +1,176 @@
+import json
+import random
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+MAX_SAMPLES = 10_000 # per timer, older samples are reservoir sampled
+
+Labels = tuple[tuple[str, str], ...]
+
+
+class Timer():
+    """Exact count and sum, bounded reservoir of samples for quantiles"""
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.samples : list[float] = []
+
+
+    def observe(self, seconds : float, rng : random.Random):
+        self.count += 1
+        self.sum += seconds
+        if len(self.samples) < MAX_SAMPLES:
+            self.samples.append(seconds)
+        else:
+            i = rng.randrange(self.count)
+            if i < MAX_SAMPLES: self.samples[i] = seconds
+
+
+    def quantiles(self, *qs : float) -> list[float]:
+        return np.quantile(self.samples, qs).tolist() if self.samples else [0.0] * len(qs)
+
+
+class Registry():
+    """In-process stage timers and counters. Cheap enough to call on every watch"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rng = random.Random(0)
+        self.timers : dict[tuple[str, Labels], Timer] = {}
+        self.counters : dict[tuple[str, Labels], float] = {}
+
+
+    def observe(self, stage : str, seconds : float, **labels):
+        key = (stage, tuple(sorted(labels.items())))
+        with self._lock:
+            timer = self.timers.get(key)
+            if timer is None:
+                timer = self.timers[key] = Timer()
+            timer.observe(seconds, self._rng)
+
+
+    @contextmanager
+    def timer(self, stage : str, **labels):
+        """ Time a block, sync or async. Failed blocks are timed too """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, **labels)
+
+
+    def inc(self, name : str, value : float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+
+    def snapshot(self) -> dict:
+        """ Picklable copy, for shipping a worker's metrics to the supervisor """
+        with self._lock:
+            return {
+                "timers": {key: (t.count, t.sum, list(t.samples)) for key, t in self.timers.items()},
+                "counters": dict(self.counters),
+            }
+
+
+    def merge(self, snapshot : dict):
+        with self._lock:
+            for key, (count, total, samples) in snapshot["timers"].items():
+                timer = self.timers.get(key)
+                if timer is None:
+                    timer = self.timers[key] = Timer()
+                timer.count += count
+                timer.sum += total
+                timer.samples.extend(samples)
+                if len(timer.samples) > MAX_SAMPLES:
+                    timer.samples = self._rng.sample(timer.samples, MAX_SAMPLES)
+            for key, value in snapshot["counters"].items():
+                self.counters[key] = self.counters.get(key, 0) + value
+
+
+    def reset(self):
+        with self._lock:
+            self.timers.clear()
+            self.counters.clear()
+
+
+    def stages(self) -> dict[str, Timer]:
+        """ Timers per stage with labels folded together """
+        stages : dict[str, Timer] = {}
+        with self._lock:
+            for (stage, _), t in self.timers.items():
+                merged = stages.setdefault(stage, Timer())
+                merged.count += t.count
+                merged.sum += t.sum
+                merged.samples.extend(t.samples)
+        return stages
+
+
+    def summary(self) -> str:
+        """ p50/p95 per stage and counter totals """
+        lines = [f"{'stage':<16}{'count':>8}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'total s':>10}"]
+        for stage, t in sorted(self.stages().items()):
+            p50, p95 = t.quantiles(0.5, 0.95)
+            lines.append(f"{stage:<16}{t.count:>8}{t.sum / t.count * 1000:>10.2f}{p50 * 1000:>10.2f}{p95 * 1000:>10.2f}{t.sum:>10.2f}")
+
+        totals : dict[str, float] = {}
+        with self._lock:
+            for (name, _), value in self.counters.items():
+                totals[name] = totals.get(name, 0) + value
+        for name, value in sorted(totals.items()):
+            lines.append(f"{name:<16}{value:>8g}")
+        return "\n".join(lines)
+
+
+    def to_prometheus(self, prefix : str = "ytaudit") -> str:
+        """ Prometheus text exposition: stage timers as summaries, counters as totals """
+        def fmt(labels : Labels, **extra) -> str:
+            pairs = [*labels, *extra.items()]
+            return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}" if pairs else ""
+
+        lines = [f"# TYPE {prefix}_stage_seconds summary"]
+        with self._lock:
+            for (stage, labels), t in sorted(self.timers.items()):
+                labels = (("stage", stage), *labels)
+                for q, v in zip((0.5, 0.95), t.quantiles(0.5, 0.95)):
+                    lines.append(f"{prefix}_stage_seconds{fmt(labels, quantile=q)} {v:.6f}")
+                lines.append(f"{prefix}_stage_seconds_count{fmt(labels)} {t.count}")
+                lines.append(f"{prefix}_stage_seconds_sum{fmt(labels)} {t.sum:.6f}")
+
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append(f"# TYPE {prefix}_{name}_total counter")
+                for (n, labels), value in sorted(self.counters.items()):
+                    if n == name: lines.append(f"{prefix}_{name}_total{fmt(labels)} {value:g}")
+        return "\n".join(lines) + "\n"
+
+
+    def write_jsonl(self, path : Path):
+        """ Append one JSON line per series, stamped with the current time """
+        now = time.time()
+        with self._lock:
+            rows = [
+                {"ts": now, "type": "timer", "name": stage, "labels": dict(labels), "count": t.count, "sum": t.sum,
+                 "p50": q[0], "p95": q[1]}
+                for (stage, labels), t in self.timers.items() for q in [t.quantiles(0.5, 0.95)]
+            ] + [
+                {"ts": now, "type": "counter", "name": name, "labels": dict(labels), "value": value}
+                for (name, labels), value in self.counters.items()
+            ]
+        with open(path, "a", encoding="utf-8") as f:
+            f.writelines(json.dumps(row) + "\n" for row in rows)
+
+
+    def export(self, path : Path):
+        """ Prometheus text for .prom files, JSON lines otherwise """
+        path = Path(path)
+        if path.suffix == ".prom":
+            path.write_text(self.to_prometheus(), encoding="utf-8")
+        else:
+            self.write_jsonl(path)
+
+
+registry = Registry()
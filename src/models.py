@@ -1,8 +1,5 @@
 from dataclasses import dataclass
-from typing import Optional, TYPE_CHECKING
-
-if TYPE_CHECKING:
-    from puppet import YTPuppet 
+from typing import Optional
 
 @dataclass
 class Video():
@@ -18,14 +15,53 @@ class Video():
     def __str__(self):
         return f"Video ID: {self.id}, video slant: {self.slant}"
 
+@dataclass
+class Recommendation(Video):
+    position : Optional[int] = None # rank in the up-next panel
+    is_short : bool = False
+    is_ad : bool = False
+    badges : Optional[list[str]] = None
+    inferred : bool = False # slant predicted by the slant model rather than read from the db
+
+@dataclass
+class Playback():
+    watch_time : float # player position when monitoring stopped
+    startup_time : Optional[float] = None # seconds until first playing event
+    stalls : int = 0
+    stall_time : float = 0
+    buffering_events : int = 0
+    kicks : int = 0 # play() retries after a pause
+    ended : bool = False
+    timed_out : bool = False
+    blocked : bool = False # play() refused on every retry, watch_time fell short of the target
+
+@dataclass(slots=True)
+class WatchRecord():
+    """Compact watch kept in puppet history, ids and slants only"""
+    state : str
+    puppet_slant : float
+    depth : int
+    video_id : str
+    video_slant : Optional[float]
+    rec_ids : tuple[str, ...]
+    rec_slants : tuple[Optional[float], ...]
+
 @dataclass
 class Watch():
     state : str
-    puppet : "YTPuppet"
+    puppet_id : str
     puppet_slant : float
     depth : int
     video : Video
-    recs : list[Video]
+    recs : list[Recommendation]
+    network : Optional[dict] = None # requests, blocked and bytes during the watch
+    playback : Optional[Playback] = None
 
     def __str__(self):
-        return f"{self.video}. Depth: {self.depth}, puppet slant: {self.puppet_slant}, puppet state: {self.state}"
\ No newline at end of file
+        return f"{self.video}. Depth: {self.depth}, puppet slant: {self.puppet_slant}, puppet state: {self.state}"
+
+    def record(self) -> WatchRecord:
+        return WatchRecord(
+            self.state, self.puppet_slant, self.depth, self.video.id, self.video.slant,
+            tuple(r.id for r in self.recs), tuple(r.slant for r in self.recs)
+        )
\ No newline at end of file
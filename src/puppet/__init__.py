@@ -1 +1,2 @@
-from .puppet import YTPuppet
\ No newline at end of file
+from .puppet import YTPuppet
+from .browser_pool import BrowserPool
\ No newline at end of file
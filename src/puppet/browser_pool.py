@@ -0,0 +1,191 @@
+from patchright.async_api import Browser, BrowserContext, Playwright, Route, async_playwright
+from contextlib import asynccontextmanager
+from pathlib import Path
+import argparse
+import asyncio
+import logging
+import os
+import tempfile
+
+import config
+
+
+class BrowserPool():
+    """Async context manager sharing a bounded number of browser processes between puppets.
+    Each puppet leases an isolated context whose cookies and storage persist in a storage-state file"""
+    def __init__(self, max_browsers : int = config.MAX_BROWSERS, contexts_per_browser : int = config.CONTEXTS_PER_BROWSER,
+                 headless : bool = True, session_dir : Path = config.SESSION_DIR, logger : logging.Logger | None = None):
+        self.max_browsers = max_browsers
+        self.contexts_per_browser = contexts_per_browser
+        self.headless = headless
+        self.session_dir = session_dir
+        self.logger = logger or logging.getLogger("BrowserPool")
+
+        self._playwright : Playwright | None = None
+        self._browsers : dict[Browser, int] = {} # browser -> leased contexts
+        self._slots = asyncio.Semaphore(max_browsers * contexts_per_browser) # admission control
+        self._lock = asyncio.Lock()
+        self.waiting = 0
+
+
+    async def __aenter__(self):
+        self._playwright = await async_playwright().start()
+        self.session_dir.mkdir(exist_ok=True)
+        return self
+
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            for browser in self._browsers:
+                await browser.close()
+        finally:
+            self._browsers.clear()
+            if self._playwright: await self._playwright.stop()
+
+
+    def state_path(self, puppet_id : str) -> Path:
+        return self.session_dir / f"{puppet_id}.json"
+
+
+    async def _acquire_browser(self) -> Browser:
+        """Least loaded browser with a free slot, launching a new one while below max_browsers"""
+        assert self._playwright
+
+        async with self._lock:
+            free = [b for b, n in self._browsers.items() if n < self.contexts_per_browser]
+            if not free or (min(self._browsers[b] for b in free) > 0 and len(self._browsers) < self.max_browsers):
+                self.logger.info(f"Launching browser {len(self._browsers) + 1}/{self.max_browsers}...")
+                browser = await self._playwright.chromium.launch(headless=self.headless, channel="chrome")
+                self._browsers[browser] = 0
+                free = [browser]
+
+            browser = min(free, key=self._browsers.get)
+            self._browsers[browser] += 1
+            return browser
+
+
+    @asynccontextmanager
+    async def lease(self, puppet_id : str):
+        """Lease an isolated context for a puppet, waiting while the pool is full"""
+        self.waiting += 1
+        async with self._slots:
+            self.waiting -= 1
+            browser = await self._acquire_browser()
+            state = self.state_path(puppet_id)
+
+            try:
+                context : BrowserContext = await browser.new_context(storage_state=state if state.exists() else None)
+                try:
+                    yield context
+                finally:
+                    try:
+                        await context.storage_state(path=state) # persist cookies and local storage
+                    except Exception as e: # crashed context, keep the previous state and the original error
+                        self.logger.warning(f"Could not save storage state for {puppet_id}: {e}")
+                    finally:
+                        await context.close()
+            finally:
+                self._browsers[browser] -= 1
+
+
+    def stats(self) -> dict:
+        """Pool occupancy and resident memory of the browser processes"""
+        return {
+            "browsers": len(self._browsers),
+            "contexts": sum(self._browsers.values()),
+            "waiting": self.waiting,
+            "rss_bytes": child_rss(),
+        }
+
+
+def child_rss(pid : int | None = None) -> int | None:
+    """Total RSS of all descendants of pid, i.e. the playwright driver and its browsers. Linux only"""
+    proc = Path("/proc")
+    if not proc.exists():
+        return None
+
+    parents : dict[int, list[int]] = {}
+    for entry in proc.iterdir():
+        if not entry.name.isdigit(): continue
+        try:
+            ppid = int((entry / "stat").read_text().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        parents.setdefault(ppid, []).append(int(entry.name))
+
+    page = os.sysconf("SC_PAGE_SIZE")
+    total = 0
+    stack = list(parents.get(pid or os.getpid(), []))
+    while stack:
+        child = stack.pop()
+        stack.extend(parents.get(child, []))
+        try:
+            total += int((proc / str(child) / "statm").read_text().split()[1]) * page
+        except (OSError, IndexError, ValueError):
+            continue
+    return total
+
+
+FIXTURE_URL = "https://fixture.test/"
+
+# counts visits in local storage and a cookie, so a second lease shows whether the storage state came back
+FIXTURE_PAGE = """<!doctype html><html><body><script>
+const visits = Number(localStorage.getItem("visits") || 0) + 1;
+localStorage.setItem("visits", visits);
+document.cookie = "visits=" + visits + "; path=/; max-age=3600";
+document.title = String(visits);
+</script></body></html>"""
+
+
+async def serve_fixture(context : BrowserContext):
+    """ Answer the fixture site from memory, without the network """
+    async def fulfill(route : Route):
+        await route.fulfill(status=200, content_type="text/html", body=FIXTURE_PAGE)
+
+    await context.route(f"{FIXTURE_URL}**", fulfill)
+
+
+async def check(puppets : int, max_browsers : int, contexts_per_browser : int, headless : bool = True) -> bool:
+    """ Lease a context per puppet against the fixture site, twice. Occupancy must stay within the pool's bounds
+    and the second round must see the first round's cookies and local storage """
+    with tempfile.TemporaryDirectory() as tmp:
+        async with BrowserPool(max_browsers, contexts_per_browser, headless, Path(tmp)) as pool:
+            peak = {"browsers": 0, "contexts": 0, "waiting": 0, "rss_bytes": 0}
+
+            async def visit(puppet_id : str) -> tuple[int, bool]:
+                async with pool.lease(puppet_id) as context:
+                    for k, v in pool.stats().items(): peak[k] = max(peak[k], v or 0)
+                    await serve_fixture(context)
+                    page = await context.new_page()
+                    await page.goto(FIXTURE_URL)
+                    visits = int(await page.title())
+                    cookies = await context.cookies(FIXTURE_URL)
+                    return visits, any(c["name"] == "visits" and c["value"] == str(visits) for c in cookies)
+
+            ids = [f"fixture-{i}" for i in range(puppets)]
+            first = await asyncio.gather(*[visit(id) for id in ids])
+            second = await asyncio.gather(*[visit(id) for id in ids])
+
+    print(f"Peak occupancy: {peak}")
+    failures = []
+    if peak["browsers"] > max_browsers: failures.append(f"{peak['browsers']} browsers launched")
+    if peak["contexts"] > max_browsers * contexts_per_browser: failures.append(f"{peak['contexts']} contexts leased at once")
+    if any(visits != 1 or not cookie for visits, cookie in first): failures.append(f"first round state: {first}")
+    if any(visits != 2 or not cookie for visits, cookie in second): failures.append(f"storage state not restored: {second}")
+
+    for failure in failures: print(f"FAIL {failure}")
+    print("ok" if not failures else f"{len(failures)} failures")
+    return not failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the browser pool against a local fixture site")
+    parser.add_argument("--puppets", type=int, default=12)
+    parser.add_argument("--max-browsers", type=int, default=2)
+    parser.add_argument("--contexts-per-browser", type=int, default=3)
+    parser.add_argument("--headed", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    ok = asyncio.run(check(args.puppets, args.max_browsers, args.contexts_per_browser, headless=not args.headed))
+    raise SystemExit(0 if ok else 1)
@@ -0,0 +1,22 @@
+from typing import Protocol
+
+from models import Video, Playback, Recommendation
+from .routing import NetworkStats
+
+
+class VideoUnavailableException(Exception):
+    pass
+
+
+class Driver(Protocol):
+    """What YTPuppet needs from a driver. Implemented by YouTubeDriver and SimulatedDriver"""
+    network : NetworkStats | None # counters of the last watch
+    playback : Playback | None # metrics of the last watch
+
+    async def __aenter__(self) -> "Driver": ...
+
+    async def __aexit__(self, exc_type, exc, tb): ...
+
+    async def consent_check(self): ...
+
+    async def watch(self, vid : Video, time : float) -> tuple[Video, list[Recommendation]]: ...
@@ -0,0 +1,333 @@
+import argparse
+import asyncio
+import atexit
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+import config
+from data_fetcher.db import ConnectionPool, ID_BATCH_SIZE
+from models import Watch
+
+if TYPE_CHECKING:
+    from scipy import sparse # imported by the matrix queries, puppets only record
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS node (
+  id INTEGER PRIMARY KEY,
+  video_id TEXT NOT NULL UNIQUE,
+  slant REAL
+);
+
+CREATE TABLE IF NOT EXISTS edge (
+  src INTEGER NOT NULL,
+  dst INTEGER NOT NULL,
+  state TEXT NOT NULL,
+  count INTEGER NOT NULL,
+  position_sum INTEGER NOT NULL,
+  min_position INTEGER NOT NULL,
+  puppet_slant_sum REAL NOT NULL,
+  first_seen REAL NOT NULL,
+  last_seen REAL NOT NULL,
+  PRIMARY KEY (src, dst, state)
+) WITHOUT ROWID; -- clustered by source, successor and k-hop scans are range reads
+"""
+
+#means of position and puppet slant are the sums over count
+EDGE_UPSERT = """
+INSERT INTO edge (src, dst, state, count, position_sum, min_position, puppet_slant_sum, first_seen, last_seen)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (src, dst, state) DO UPDATE SET
+  count = edge.count + excluded.count,
+  position_sum = edge.position_sum + excluded.position_sum,
+  min_position = MIN(edge.min_position, excluded.min_position),
+  puppet_slant_sum = edge.puppet_slant_sum + excluded.puppet_slant_sum,
+  last_seen = excluded.last_seen
+"""
+
+NODE_UPSERT = """
+INSERT INTO node (video_id, slant) VALUES (?, ?)
+ON CONFLICT (video_id) DO UPDATE SET slant = COALESCE(excluded.slant, node.slant)
+"""
+
+
+logger = logging.getLogger("RecGraph")
+
+# separate file from the video db, so its writes get their own thread instead of queueing on the db worker
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="graph-writer")
+
+
+class RecGraph():
+    """Directed graph of observed recommendations, video -> each of its up-next recs, aggregated per puppet state.
+    Watches are aggregated in memory and written in batches; queries flush first.
+    Matrix queries run on a CSR snapshot rebuilt when the graph changed"""
+    def __init__(self, path : Path = config.GRAPH_DB_PATH, flush_every : int = config.GRAPH_FLUSH_WATCHES):
+        self.pool = ConnectionPool(path)
+        with self.pool.get() as con:
+            con.executescript(SCHEMA)
+
+        self.flush_every = flush_every
+        self._nodes : dict[str, tuple[int, float | None]] = {} # video id -> node id, last written slant
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._snapshot = None # (key, matrix, video ids, slants)
+
+        # delta since the last flush
+        self._pending_nodes : dict[str, float | None] = {}
+        self._pending_edges : dict[tuple[str, str, str], list] = {} # count, position sum, min position, puppet slant sum, first, last seen
+        self._buffered = 0
+        atexit.register(self.flush)
+
+
+    def node_ids(self, con, vids : dict[str, float | None]) -> dict[str, int]:
+        """ Upsert new nodes and changed slants, keeping the last known slant, and return node ids """
+        changed = [(id, slant) for id, slant in vids.items() if id not in self._nodes or (slant is not None and self._nodes[id][1] != slant)]
+        if changed:
+            con.executemany(NODE_UPSERT, changed)
+            ids = [id for id, _ in changed]
+            for i in range(0, len(ids), ID_BATCH_SIZE):
+                batch = ids[i:i+ID_BATCH_SIZE]
+                placeholders = ",".join("?" for x in batch)
+                self._nodes.update((v, (n, s)) for n, v, s in con.execute(f"SELECT id, video_id, slant FROM node WHERE video_id IN ({placeholders})", batch))
+        return {id: self._nodes[id][0] for id in vids}
+
+
+    def record(self, watch : Watch):
+        """ Add the edges observed in one watch, flushing once enough watches piled up """
+        if self.add(watch): self.flush()
+
+
+    def add(self, watch : Watch) -> bool:
+        """ Add the edges observed in one watch to the pending delta. True when it is due for a flush """
+        if not watch.recs:
+            return False
+        now = time.time()
+        slant = watch.puppet_slant if watch.puppet_slant is not None else 0.0
+
+        with self._lock:
+            for vid in (watch.video, *watch.recs):
+                if vid.slant is not None or vid.id not in self._pending_nodes:
+                    self._pending_nodes[vid.id] = vid.slant
+
+            for i, r in enumerate(watch.recs):
+                p = r.position if r.position is not None else i
+                edge = self._pending_edges.get((watch.video.id, r.id, watch.state))
+                if edge is None:
+                    self._pending_edges[(watch.video.id, r.id, watch.state)] = [1, p, p, slant, now, now]
+                else:
+                    edge[0] += 1; edge[1] += p; edge[2] = min(edge[2], p); edge[3] += slant; edge[5] = now
+
+            self._buffered += 1
+            return self._buffered >= self.flush_every
+
+
+    def flush(self):
+        """ Write the pending delta in one transaction """
+        with self._flush_lock: # one writer, so node ids handed out stay consistent
+            with self._lock:
+                nodes, edges, buffered = self._pending_nodes, self._pending_edges, self._buffered
+                self._pending_nodes, self._pending_edges, self._buffered = {}, {}, 0
+            if not edges:
+                return
+
+            try:
+                with self.pool.get() as con:
+                    ids = self.node_ids(con, nodes)
+                    rows = sorted((ids[src], ids[dst], state, *agg) for (src, dst, state), agg in edges.items()) # b-tree order
+                    con.executemany(EDGE_UPSERT, rows)
+            except Exception:
+                self._nodes.clear() # ids of rolled back nodes may be handed out again
+                self.restore(nodes, edges, buffered)
+                raise
+
+
+    def restore(self, nodes : dict[str, float | None], edges : dict[tuple[str, str, str], list], buffered : int):
+        """ Put a delta that failed to write back in front of what was added since, so the next flush retries it """
+        with self._lock:
+            for id, slant in nodes.items():
+                if self._pending_nodes.get(id) is None and (slant is not None or id not in self._pending_nodes):
+                    self._pending_nodes[id] = slant
+
+            for key, agg in edges.items():
+                edge = self._pending_edges.get(key)
+                if edge is None:
+                    self._pending_edges[key] = agg
+                else:
+                    edge[0] += agg[0]; edge[1] += agg[1]; edge[2] = min(edge[2], agg[2]); edge[3] += agg[3]; edge[4] = agg[4]
+
+            self._buffered += buffered
+
+
+    async def arecord(self, watch : Watch):
+        """ record without blocking the event loop. Flushes run in the background on the graph writer thread """
+        if self.add(watch):
+            future = asyncio.get_running_loop().run_in_executor(_executor, self.flush)
+            future.add_done_callback(lambda f: f.exception() and logger.error(f"Graph flush failed: {f.exception()!r}"))
+
+
+    async def aflush(self):
+        await asyncio.get_running_loop().run_in_executor(_executor, self.flush)
+
+
+    def successors(self, video_id : str, state : str | None = None, min_count : int = 1) -> tuple[list[str], np.ndarray]:
+        """ Recommended videos after video_id and how often each was seen """
+        self.flush()
+        sql = """
+            SELECT n.video_id, SUM(e.count) FROM edge e
+            JOIN node s ON s.id = e.src JOIN node n ON n.id = e.dst
+            WHERE s.video_id = ? AND (? IS NULL OR e.state = ?)
+            GROUP BY e.dst HAVING SUM(e.count) >= ?
+        """
+        rows = self.pool.get().execute(sql, (video_id, state, state, min_count)).fetchall()
+        return [r[0] for r in rows], np.array([r[1] for r in rows], dtype=np.int64)
+
+
+    def neighbourhood(self, video_id : str, k : int = 2, min_count : int = 1, state : str | None = None) -> dict[str, int]:
+        """ Videos reachable within k recommendations, with their hop distance. Breadth first, one query per hop and id batch """
+        self.flush()
+        con = self.pool.get()
+        row = con.execute("SELECT id FROM node WHERE video_id = ?", (video_id,)).fetchone()
+        if row is None:
+            return {}
+
+        hops = {row[0]: 0}
+        frontier = [row[0]]
+        for hop in range(1, k + 1):
+            found = set()
+            for i in range(0, len(frontier), ID_BATCH_SIZE):
+                batch = frontier[i:i+ID_BATCH_SIZE]
+                placeholders = ",".join("?" for x in batch)
+                rows = con.execute(f"""
+                    SELECT dst FROM edge WHERE src IN ({placeholders}) AND (? IS NULL OR state = ?)
+                    GROUP BY src, dst HAVING SUM(count) >= ?
+                    """, [*batch, state, state, min_count])
+                found.update(r[0] for r in rows)
+            frontier = [n for n in found if n not in hops]
+            hops.update((n, hop) for n in frontier)
+            if not frontier: break
+
+        names = {}
+        ids = list(hops)
+        for i in range(0, len(ids), ID_BATCH_SIZE):
+            batch = ids[i:i+ID_BATCH_SIZE]
+            placeholders = ",".join("?" for x in batch)
+            names.update(con.execute(f"SELECT id, video_id FROM node WHERE id IN ({placeholders})", batch))
+        return {names[n]: h for n, h in hops.items()}
+
+
+    def counts(self, state : str | None = None, min_count : int = 1) -> tuple["sparse.csr_matrix", np.ndarray, np.ndarray]:
+        """ Edge count matrix over all nodes as CSR, with the video id and last known slant of every row """
+        from scipy import sparse
+
+        self.flush()
+        con = self.pool.get()
+        key = (con.execute("SELECT COUNT(*), MAX(last_seen) FROM edge").fetchone(), state, min_count)
+        if self._snapshot is not None and self._snapshot[0] == key:
+            return self._snapshot[1:]
+
+        nodes = con.execute("SELECT id, video_id, slant FROM node ORDER BY id").fetchall()
+        pos = np.zeros(nodes[-1][0] + 1 if nodes else 1, dtype=np.int64) # node ids are dense but not guaranteed contiguous
+        pos[[n[0] for n in nodes]] = np.arange(len(nodes))
+        ids = np.array([n[1] for n in nodes], dtype=object)
+        slants = np.array([np.nan if n[2] is None else n[2] for n in nodes], dtype=np.float64)
+
+        edges = np.array(con.execute("""
+            SELECT src, dst, SUM(count) FROM edge WHERE (? IS NULL OR state = ?)
+            GROUP BY src, dst HAVING SUM(count) >= ?
+            """, (state, state, min_count)).fetchall(), dtype=np.int64).reshape(-1, 3)
+
+        matrix = sparse.csr_matrix((edges[:, 2], (pos[edges[:, 0]], pos[edges[:, 1]])), shape=(len(nodes), len(nodes)))
+        self._snapshot = (key, matrix, ids, slants)
+        return matrix, ids, slants
+
+
+    def transition_matrix(self, state : str | None = None, min_count : int = 1) -> tuple["sparse.csr_matrix", np.ndarray]:
+        """ Row-stochastic video to video transition matrix. Videos never watched have empty rows """
+        from scipy import sparse
+
+        counts, ids, _ = self.counts(state, min_count)
+        out = np.asarray(counts.sum(axis=1)).ravel()
+        inv = np.divide(1.0, out, out=np.zeros_like(out, dtype=np.float64), where=out > 0)
+        return sparse.diags(inv) @ counts, ids
+
+
+    def slant_transitions(self, bins : np.ndarray = np.linspace(-1, 1, 11), state : str | None = None) -> np.ndarray:
+        """ Count-weighted transitions between slant bins of the watched and the recommended video, rows normalised """
+        counts, _, slants = self.counts(state)
+        coo = counts.tocoo()
+        src, dst = slants[coo.row], slants[coo.col]
+        known = ~(np.isnan(src) | np.isnan(dst))
+        hist, _, _ = np.histogram2d(src[known], dst[known], bins=[bins, bins], weights=coo.data[known])
+        rows = hist.sum(axis=1, keepdims=True)
+        return np.divide(hist, rows, out=np.zeros_like(hist), where=rows > 0)
+
+
+    def stationary(self, state : str | None = None, damping : float = 0.85, tol : float = 1e-10, max_iter : int = 1000) -> tuple[np.ndarray, np.ndarray]:
+        """ Long-run share of a random walker following recommendations, by power iteration.
+        With probability 1 - damping, and from videos without recorded recs, the walker restarts uniformly """
+        P, ids = self.transition_matrix(state)
+        n = P.shape[0]
+        if n == 0:
+            return np.zeros(0), ids
+
+        dangling = np.asarray(P.sum(axis=1)).ravel() == 0
+        PT = P.T.tocsr()
+        x = np.full(n, 1 / n)
+        for _ in range(max_iter):
+            nxt = damping * (PT @ x + x[dangling].sum() / n) + (1 - damping) / n
+            if np.abs(nxt - x).sum() < tol:
+                x = nxt
+                break
+            x = nxt
+        return x / x.sum(), ids
+
+
+    def stationary_slant(self, bins : np.ndarray = np.linspace(-1, 1, 11), **kwargs) -> np.ndarray:
+        """ Stationary mass per slant bin, over videos with a known slant """
+        x, _ = self.stationary(**kwargs)
+        _, _, slants = self.counts(kwargs.get("state"))
+        known = ~np.isnan(slants)
+        hist, _ = np.histogram(slants[known], bins=bins, weights=x[known])
+        return hist / hist.sum() if hist.sum() else hist
+
+
+    def stats(self) -> dict:
+        self.flush()
+        con = self.pool.get()
+        nodes, = con.execute("SELECT COUNT(*) FROM node").fetchone()
+        edges, observations = con.execute("SELECT COUNT(*), COALESCE(SUM(count), 0) FROM edge").fetchone()
+        return {"nodes": nodes, "edges": edges, "observations": observations}
+
+
+@lru_cache(maxsize=1)
+def get_graph() -> RecGraph:
+    return RecGraph()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the recommendation graph")
+    parser.add_argument("--path", type=Path, default=config.GRAPH_DB_PATH)
+    parser.add_argument("--video", default=None, help="print the k-hop neighbourhood of a video")
+    parser.add_argument("-k", type=int, default=2)
+    parser.add_argument("--state", default=None, help="training or drifting, both by default")
+    args = parser.parse_args()
+
+    graph = RecGraph(args.path)
+    print(graph.stats())
+
+    if args.video:
+        start = time.perf_counter()
+        hood = graph.neighbourhood(args.video, args.k, state=args.state)
+        print(f"{len(hood)} videos within {args.k} hops in {time.perf_counter() - start:.3f}s")
+
+    np.set_printoptions(precision=3, suppress=True, linewidth=160)
+    start = time.perf_counter()
+    print(f"Slant transitions:\n{graph.slant_transitions(state=args.state)}")
+    print(f"Stationary slant distribution: {graph.stationary_slant(state=args.state)}")
+    print(f"Matrix queries in {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,184 @@
+from patchright.async_api import BrowserContext, Page, Route, async_playwright
+import argparse
+import asyncio
+
+from models import Playback
+
+# Resolves once the main video has played `target` seconds (ads excluded), the video ends or the timeout hits.
+# Stall and buffering metrics live on window.__ytPlayback so they survive a retry after a blocked play().
+PLAYBACK_SCRIPT = """
+([target, kickMs, timeoutMs]) => new Promise((resolve) => {
+    const m = window.__ytPlayback ??= {
+        started_at: performance.now(), first_play_ms: null, stalls: 0, stall_ms: 0,
+        buffering_events: 0, kicks: 0, ended: false, timed_out: false, current_time: 0,
+    };
+    let stallStart = null, kickTimer = null, timeoutTimer = null, video = null, observer = null;
+
+    const adShowing = () => !!document.querySelector("#movie_player.ad-showing");
+    const events = ["timeupdate", "playing", "waiting", "pause", "ended"];
+
+    const finish = (reason) => {
+        clearTimeout(kickTimer); clearTimeout(timeoutTimer);
+        observer?.disconnect();
+        if (video) events.forEach((e) => video.removeEventListener(e, handle));
+        if (stallStart !== null) { m.stall_ms += performance.now() - stallStart; m.stalls++; stallStart = null; }
+        m.current_time = video?.currentTime ?? 0;
+        resolve({...m, reason});
+    };
+
+    const kick = () => {
+        clearTimeout(kickTimer);
+        kickTimer = setTimeout(() => {
+            if (!video || !video.paused) return;
+            m.kicks++;
+            video.play().catch(() => finish("blocked")); // autoplay policy, caller sends a real key press
+        }, kickMs);
+    };
+
+    const handle = (e) => {
+        const now = performance.now();
+        switch (e.type) {
+            case "timeupdate":
+                if (!adShowing() && video.currentTime >= target) finish("target");
+                break;
+            case "playing":
+                if (m.first_play_ms === null) m.first_play_ms = now - m.started_at;
+                if (stallStart !== null) { m.stall_ms += now - stallStart; m.stalls++; stallStart = null; }
+                break;
+            case "waiting":
+                m.buffering_events++;
+                stallStart ??= now;
+                break;
+            case "pause":
+                kick();
+                break;
+            case "ended":
+                if (!adShowing()) { m.ended = true; finish("ended"); }
+                break;
+        }
+    };
+
+    const attach = (v) => {
+        video = v;
+        events.forEach((e) => video.addEventListener(e, handle));
+        if (!adShowing() && video.currentTime >= target) return finish("target");
+        if (video.paused) kick();
+    };
+
+    timeoutTimer = setTimeout(() => { m.timed_out = true; finish("timeout"); }, timeoutMs);
+
+    const existing = document.querySelector("video");
+    if (existing) return attach(existing);
+    observer = new MutationObserver(() => {
+        const v = document.querySelector("video");
+        if (v) { observer.disconnect(); observer = null; attach(v); }
+    });
+    observer.observe(document.documentElement, {childList: true, subtree: true});
+})
+"""
+
+MAX_BLOCKED_RETRIES = 3
+
+
+async def monitor_playback(page : Page, target : float, kick_after : float = 3.0, timeout : float | None = None) -> Playback:
+    """Wait until target seconds of the video have played, driven by media events in the page"""
+    timeout = timeout if timeout is not None else target * 2 + 30
+    await page.evaluate("delete window.__ytPlayback")
+
+    for _ in range(MAX_BLOCKED_RETRIES):
+        result = await asyncio.wait_for(
+            page.evaluate(PLAYBACK_SCRIPT, [target, kick_after * 1000, timeout * 1000]),
+            timeout + 5
+        )
+        if result["reason"] != "blocked":
+            break
+        await page.keyboard.press("k") # trusted gesture, play() from script was refused
+
+    return Playback(
+        watch_time=result["current_time"],
+        startup_time=result["first_play_ms"] / 1000 if result["first_play_ms"] is not None else None,
+        stalls=result["stalls"],
+        stall_time=result["stall_ms"] / 1000,
+        buffering_events=result["buffering_events"],
+        kicks=result["kicks"],
+        ended=result["ended"],
+        timed_out=result["timed_out"],
+        blocked=result["reason"] == "blocked",
+    )
+
+
+FIXTURE_URL = "https://www.youtube.com/watch?v=fixture"
+
+# a <video> playing a generated silent wav. Query params: duration (s), delay before play() in ms (-1: never),
+# stall: a synthetic waiting/playing pair of 500ms, 500ms after playback starts, block: play() from script is always refused
+FIXTURE_WATCH = """<!doctype html><html><body>
+<video muted></video>
+<script>
+const params = new URLSearchParams(location.search);
+const rate = 8000, samples = Number(params.get("duration") ?? 10) * rate;
+const wav = new DataView(new ArrayBuffer(44 + samples));
+const ascii = (offset, text) => [...text].forEach((c, i) => wav.setUint8(offset + i, c.charCodeAt(0)));
+ascii(0, "RIFF"); wav.setUint32(4, 36 + samples, true); ascii(8, "WAVE");
+ascii(12, "fmt "); wav.setUint32(16, 16, true); wav.setUint16(20, 1, true); wav.setUint16(22, 1, true);
+wav.setUint32(24, rate, true); wav.setUint32(28, rate, true); wav.setUint16(32, 1, true); wav.setUint16(34, 8, true);
+ascii(36, "data"); wav.setUint32(40, samples, true);
+new Uint8Array(wav.buffer, 44).fill(128);
+
+const video = document.querySelector("video");
+if (params.has("block")) video.play = () => Promise.reject(new DOMException("play() refused", "NotAllowedError"));
+video.src = URL.createObjectURL(new Blob([wav.buffer], {type: "audio/wav"}));
+const delay = Number(params.get("delay") ?? 500);
+if (delay >= 0) setTimeout(() => video.play(), delay);
+if (params.has("stall")) video.addEventListener("playing", () => setTimeout(() => {
+    video.dispatchEvent(new Event("waiting"));
+    setTimeout(() => video.dispatchEvent(new Event("playing")), 500);
+}, 500), {once: true});
+</script>
+</body></html>"""
+
+# name -> (query, target, kick_after, expectation on the Playback)
+FIXTURE_CASES = {
+    "target": ("duration=10", 2, 3.0, lambda p: p.watch_time >= 2 and p.startup_time is not None and not p.ended and p.stalls == 0),
+    "stall": ("duration=10&stall=1", 2, 3.0, lambda p: p.stalls == 1 and p.buffering_events == 1 and 0.4 < p.stall_time < 0.8),
+    "ended": ("duration=2", 5, 3.0, lambda p: p.ended and not p.timed_out),
+    "kick": ("duration=10&delay=-1", 1, 0.5, lambda p: p.kicks >= 1 and p.watch_time >= 1),
+    "blocked": ("duration=10&delay=-1&block=1", 1, 0.5, lambda p: p.blocked and not p.timed_out and p.watch_time < 1),
+}
+
+
+async def serve_fixture(context : BrowserContext):
+    """ Answer watch pages with the local video page """
+    async def fulfill(route : Route):
+        await route.fulfill(status=200, content_type="text/html", body=FIXTURE_WATCH)
+
+    await context.route("https://www.youtube.com/watch**", fulfill)
+
+
+async def check(headless : bool = True) -> bool:
+    """ Monitor playback of the fixture video in each case and compare the recorded Playback with what the page did """
+    failures = []
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=headless, channel="chrome")
+        try:
+            context = await browser.new_context()
+            await serve_fixture(context)
+            page = await context.new_page()
+            for name, (query, target, kick_after, expect) in FIXTURE_CASES.items():
+                await page.goto(f"{FIXTURE_URL}&{query}")
+                playback = await monitor_playback(page, target, kick_after=kick_after)
+                print(f"{name}: {playback}")
+                if not expect(playback): failures.append(name)
+        finally:
+            await browser.close()
+
+    for failure in failures: print(f"FAIL {failure}")
+    print("ok" if not failures else f"{len(failures)} failures")
+    return not failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check event-driven playback monitoring against a local video page")
+    parser.add_argument("--headed", action="store_true")
+    args = parser.parse_args()
+
+    raise SystemExit(0 if asyncio.run(check(headless=not args.headed)) else 1)
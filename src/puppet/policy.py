@@ -0,0 +1,135 @@
+from abc import ABC, abstractmethod
+from typing import Protocol
+
+import numpy as np
+
+from models import Recommendation
+
+
+class Policy(Protocol):
+    """Picks the next video among the recommendations of a watch. None means no rec could be scored"""
+    def select(self, recs : list[Recommendation], target : float) -> Recommendation | None: ...
+
+
+def drift_step(cur : float, target : float, steps_left : int) -> float:
+    """Linear drift: an equal step toward target each watch, landing on it after steps_left steps"""
+    if steps_left <= 0:
+        return target
+    return cur + (target - cur) / steps_left
+
+
+class ScoredPolicy(ABC):
+    """Base for policies scoring rec slants as one array. Ads, Shorts and unknown slants are never picked"""
+    param : str | None = None # keyword set by the argument of a policy spec, see make_policy
+
+    def __init__(self, skip_ads=True, skip_shorts=True, seed : int | None = None):
+        self.skip_ads = skip_ads
+        self.skip_shorts = skip_shorts
+        self.rng = np.random.default_rng(seed)
+
+
+    def candidates(self, recs : list[Recommendation]) -> tuple[np.ndarray, np.ndarray]:
+        """Indices of eligible recs and their slants"""
+        slants = np.array([r.slant if r.slant is not None else np.nan for r in recs], dtype=np.float64)
+        ok = ~np.isnan(slants)
+        if self.skip_ads: ok &= ~np.array([getattr(r, "is_ad", False) for r in recs], dtype=bool)
+        if self.skip_shorts: ok &= ~np.array([getattr(r, "is_short", False) for r in recs], dtype=bool)
+        idx = np.flatnonzero(ok)
+        return idx, slants[idx]
+
+
+    def select(self, recs : list[Recommendation], target : float) -> Recommendation | None:
+        if not recs:
+            return None
+        idx, slants = self.candidates(recs)
+        if len(idx) == 0:
+            return None
+        return recs[idx[self.choose(np.abs(slants - target))]]
+
+
+    @abstractmethod
+    def choose(self, dist : np.ndarray) -> int:
+        """Index of the picked candidate, given the distance of each candidate's slant to the target"""
+
+
+class NearestSlant(ScoredPolicy):
+    def choose(self, dist : np.ndarray) -> int:
+        return int(np.argmin(dist))
+
+
+class SoftmaxDistance(ScoredPolicy):
+    """Samples recs with probability proportional to exp(-distance / temperature)"""
+    param = "temperature"
+
+    def __init__(self, temperature : float = 0.1, **kwargs):
+        if not temperature > 0: # 0 divides by zero, below 0 prefers the farthest rec
+            raise ValueError(f"temperature must be > 0, got {temperature}")
+        super().__init__(**kwargs)
+        self.temperature = temperature
+
+
+    def choose(self, dist : np.ndarray) -> int:
+        logits = -dist / self.temperature
+        p = np.exp(logits - logits.max())
+        return int(self.rng.choice(len(dist), p=p / p.sum()))
+
+
+class EpsilonGreedy(ScoredPolicy):
+    """Nearest slant, except a uniformly random rec with probability epsilon"""
+    param = "epsilon"
+
+    def __init__(self, epsilon : float = 0.1, **kwargs):
+        if not 0 <= epsilon <= 1:
+            raise ValueError(f"epsilon must be in [0, 1], got {epsilon}")
+        super().__init__(**kwargs)
+        self.epsilon = epsilon
+
+
+    def choose(self, dist : np.ndarray) -> int:
+        if self.rng.random() < self.epsilon:
+            return int(self.rng.integers(len(dist)))
+        return int(np.argmin(dist))
+
+
+POLICIES = {"nearest": NearestSlant, "softmax": SoftmaxDistance, "egreedy": EpsilonGreedy}
+
+
+def make_policy(spec : str, seed : int | None = None) -> Policy:
+    """Build a policy from a spec like nearest, softmax:0.1 or egreedy:0.2"""
+    name, sep, arg = spec.partition(":")
+    if name not in POLICIES:
+        raise ValueError(f"Unknown policy {name}, expected one of {', '.join(POLICIES)}")
+    cls = POLICIES[name]
+    if not sep:
+        return cls(seed=seed)
+    if cls.param is None:
+        raise ValueError(f"Policy {name} takes no argument")
+    try:
+        return cls(seed=seed, **{cls.param: float(arg)})
+    except ValueError as e:
+        raise ValueError(f"Invalid policy {spec}: {e}") from e
+
+
+def check() -> bool:
+    """ Valid specs build their policy, invalid ones are rejected with a ValueError naming the spec """
+    failures = []
+    for spec in ("nearest", "softmax", "softmax:0.5", "egreedy:0", "egreedy:1"):
+        try:
+            make_policy(spec, seed=0)
+        except ValueError as e:
+            failures.append(f"{spec} rejected: {e}")
+
+    for spec in ("nearest:0.1", "unknown", "softmax:0", "softmax:-0.1", "softmax:nan", "softmax:", "egreedy:-0.1", "egreedy:1.5"):
+        try:
+            make_policy(spec, seed=0)
+            failures.append(f"{spec} accepted")
+        except ValueError as e:
+            if spec.split(":")[0] not in str(e): failures.append(f"{spec} error does not name the spec: {e}")
+
+    for failure in failures: print(f"FAIL {failure}")
+    print("ok" if not failures else f"{len(failures)} failures")
+    return not failures
+
+
+if __name__ == "__main__":
+    raise SystemExit(0 if check() else 1)
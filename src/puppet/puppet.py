@@ -1,79 +1,170 @@
+import atexit
 import logging
+import queue
+import time
+from logging.handlers import QueueHandler, QueueListener
+from pathlib import Path
 from typing import Literal
-import pandas as pd
 
-from .youtube_driver import YouTubeDriver, VideoUnavailableException
+from .youtube_driver import YouTubeDriver
+from .driver import Driver, VideoUnavailableException
+from .browser_pool import BrowserPool
+from .routing import RouteConfig
 import config
 
-from data_fetcher import get_video, get_videos, update_videos
-from models import Watch, Video
+from data_fetcher import async_db
+from data_fetcher.slant_index import ExclusionSet
+from models import Watch, WatchRecord, Video
+from .trajectory import TrajectoryWriter, get_writer
+from .graph import RecGraph, get_graph
+from .policy import Policy, NearestSlant, drift_step
+from classifier.inference import SlantInferer, get_inferer
+from metrics import registry
 
 PuppetState = Literal["init", "training", "drifting", "closed"]
 
+
+class PuppetFileHandler(logging.Handler):
+    """Writes each puppet logger's records to its own file in the log dir, opened on first record"""
+    def __init__(self, log_dir : Path):
+        super().__init__()
+        self.log_dir = log_dir
+        self.files : dict[str, logging.FileHandler] = {}
+
+
+    def emit(self, record : logging.LogRecord):
+        handler = self.files.get(record.name)
+        if handler is None:
+            handler = self.files[record.name] = logging.FileHandler(self.log_dir / record.name, encoding="utf-8")
+            handler.setFormatter(self.formatter)
+        handler.emit(record)
+
+
+    def close(self):
+        for handler in self.files.values(): handler.close()
+        self.files.clear()
+        super().close()
+
+
+_log_queue : queue.SimpleQueue = queue.SimpleQueue()
+_listener : QueueListener | None = None
+
+
+def log_queue() -> queue.SimpleQueue:
+    """Queue feeding one listener thread that does all console and file writes, so the event loop never blocks on disk"""
+    global _listener
+    if _listener is None:
+        formatter = logging.Formatter(
+            "%(asctime)s [%(levelname)s] %(name)s: %(message)s",
+            datefmt="%Y-%m-%d %H:%M:%S",
+        )
+        console_handler = logging.StreamHandler()
+        file_handler = PuppetFileHandler(config.LOG_DIR)
+        for handler in (console_handler, file_handler): handler.setFormatter(formatter)
+
+        _listener = QueueListener(_log_queue, console_handler, file_handler)
+        _listener.start()
+        atexit.register(_listener.stop) # drain before exit
+    return _log_queue
+
 class YTPuppet():
-    def __init__(self, id : str, slant : float, target_slant : float, headless : bool = True):
+    def __init__(self, id : str, slant : float, target_slant : float, headless : bool = True, pool : BrowserPool | None = None,
+                 sink : TrajectoryWriter | None = None, resume : bool = True, driver : type[Driver] = YouTubeDriver,
+                 driver_args : dict | None = None, export_dir : Path | None = config.PUPPETS_DIR, policy : Policy | None = None,
+                 inferer : SlantInferer | None = None, graph : RecGraph | None = None):
         self.ID = id
+        self.initial_slant = slant
         self.cur_slant = slant
         self.target_slant = target_slant
 
         self.cur_state : PuppetState = "init"
-        self.history : list[Watch] = []
+        self.history : list[WatchRecord] = []
+        self.sink = sink or get_writer() # flushed after every watch
+        self.next_video_id : str | None = None # drift checkpoint
+        self.resume_run = resume
+        self.policy = policy or NearestSlant() # next video during drift
+        self.inferer = inferer or (get_inferer() if config.INFER_SLANTS and config.SLANT_MODEL_PATH.exists() else None) # slants of recs missing from the db
+        self.watched : ExclusionSet | None = None # bitset of watched videos over the slant index
+        self.graph = graph or (get_graph() if config.RECORD_GRAPH else None) # recommendation edges across puppets
 
         self.setup_logger()
 
-        self.driver = YouTubeDriver
+        self.driver = driver
         self.driver_args = {
             "session_dir": config.SESSION_DIR / id,
             "headless": headless,
             "ublock_path": config.UBLOCK_PATH,
-            "logger": self.logger
+            "logger": self.logger,
+            "pool": pool,
+            "routing": RouteConfig(max_quality=config.MAX_QUALITY) if config.BLOCK_ASSETS else None,
+            "warm_start": config.WARM_START,
+            **(driver_args or {})
         }
+        self.export_dir = export_dir # end-of-run CSV, None to skip
 
 
     def setup_logger(self):
         self.logger = logging.getLogger(self.ID)
         self.logger.setLevel(logging.DEBUG)
+        self.logger.propagate = False
 
-        formatter = logging.Formatter(
-            "%(asctime)s [%(levelname)s] %(name)s: %(message)s",
-            datefmt="%Y-%m-%d %H:%M:%S",
-        )
-
-        file_handler = logging.FileHandler(config.LOG_DIR / self.ID, encoding="utf-8")
-        file_handler.setFormatter(formatter)
-
-        console_handler = logging.StreamHandler()
-        console_handler.setFormatter(formatter)
-
-        self.logger.addHandler(file_handler)
-        self.logger.addHandler(console_handler)
+        if not self.logger.handlers: # loggers are process-wide, a retried puppet keeps its handler
+            self.logger.addHandler(QueueHandler(log_queue()))
 
 
-    async def watch(self, driver : YouTubeDriver, vid : Video, wt : int) -> Watch:
-        vid, recs = await driver.watch(vid, wt)
+    async def watch(self, driver : Driver, vid : Video, wt : int) -> Watch:
+        start = time.perf_counter()
+        with registry.timer("driver"):
+            vid, recs = await driver.watch(vid, wt)
 
+        with registry.timer("enrich"):
+            known = await async_db.get_slants([rec.id for rec in recs])
         for rec in recs:
-            rec_vid = get_video(rec.id)
-            if rec_vid is not None: rec.slant = rec_vid.slant
-
-        watch = Watch(self.cur_state, self, self.cur_slant, len(self.history) + 1, vid, recs)
-        self.history.append(watch)
+            if known.get(rec.id) is not None: rec.slant = known[rec.id]
+
+        unknown = [rec.id for rec in recs if rec.slant is None]
+        if unknown and self.inferer is not None: # bounded wait, late results only warm the cache
+            with registry.timer("infer"):
+                inferred = await self.inferer.infer(unknown, config.INFERENCE_DEADLINE)
+            for rec in recs:
+                if rec.id in inferred: rec.slant, rec.inferred = inferred[rec.id], True
+
+        network = driver.network.snapshot() if driver.network else None
+        watch = Watch(self.cur_state, self.ID, self.cur_slant, len(self.history) + 1, vid, recs, network, driver.playback)
+        with registry.timer("flush"):
+            await async_db.run(self.sink.write, watch)
+        if self.graph is not None:
+            with registry.timer("graph"):
+                await self.graph.arecord(watch)
+
+        blocked = driver.playback is not None and driver.playback.blocked
+        registry.inc("watches", puppet=self.ID, state="blocked" if blocked else self.cur_state) # not counted as a watch of the puppet's state
+        registry.inc("recs", len(recs))
+        registry.inc("recs_inferred", sum(rec.inferred for rec in recs))
+        registry.inc("recs_unscored", sum(rec.slant is None for rec in recs))
+        registry.observe("watch", time.perf_counter() - start)
+        self.history.append(watch.record())
+        if self.watched is not None: self.watched.add(vid.id)
 
         self.logger.info(f"Finished watch. {watch}")
+        if network: self.logger.debug(f"Network: {network}")
+        if driver.playback: self.logger.debug(f"Playback: {driver.playback}")
 
         return watch
 
 
-    async def train(self, driver : YouTubeDriver, slant_margin = 0.2, depth = 100, wt = 30):
+    async def train(self, driver : Driver, slant_margin = 0.2, depth = 100, wt = 30):
         self.cur_state = "training"
+        depth -= self.completed("training") # resumed run
 
         slant_range = (self.cur_slant-slant_margin, self.cur_slant+slant_margin)
 
         self.logger.info(f"Fetching train videos in slant range: {slant_range}")
-        train_vids = get_videos(
+        train_vids = await async_db.get_videos(
             slant_range=slant_range,
+            exclude=self.watched,
             n=depth
-        )
+        ) if depth > 0 else []
 
         blacklist = []
         for vid in train_vids:
@@ -83,72 +174,128 @@ class YTPuppet():
                 vid.blacklist = True
                 blacklist.append(vid)
 
-        update_videos(blacklist)
+        await async_db.update_videos(blacklist)
 
 
-    async def drift(self, driver : YouTubeDriver, seed_margin = 0.2, depth = 200, wt = 30):
+    async def drift(self, driver : Driver, seed_margin = 0.2, depth = 200, wt = 30):
         self.cur_state = "drifting"
 
         slant_range = (self.cur_slant-seed_margin, self.cur_slant+seed_margin)
         self.logger.info(f"Fetching drift seed video in slant range: {slant_range}")
 
-        next_vid = get_videos(
+        seeds = await async_db.get_videos(
             slant_range=slant_range,
-            exclude=[watch.video.id for watch in self.history],
+            exclude=self.watched if self.watched is not None else [watch.video_id for watch in self.history],
             n=1
-        )[0]
+        )
+        next_vid = seeds[0] if seeds else await self.fallback()
+
+        if self.next_video_id is not None: # resume where the last run stopped
+            next_vid = Video(self.next_video_id)
+
+        remaining = depth - self.completed("drifting")
+        for i in range(remaining):
+            if next_vid is None:
+                self.logger.warning("No video left to drift to. Stopping drift.")
+                break
 
-        for i in range(depth):
             try:
                 watch = await self.watch(driver, next_vid, wt)
             except VideoUnavailableException: #skip if unavailable
+                if self.watched is not None: self.watched.add(next_vid.id)
+                next_vid = await self.fallback()
                 continue
-            
-            self.cur_slant = (self.target_slant - self.cur_slant) / depth # drift term
 
-            next_vid = min( # select closest slant
-                watch.recs,
-                key=lambda rec: abs(rec.slant - self.cur_slant) if rec.slant is not None else float("inf")
-            )
-            self.logger.info(f"Up next video slant: {next_vid.slant}")
+            self.cur_slant = drift_step(self.cur_slant, self.target_slant, remaining - i) # drift term
+
+            with registry.timer("select"):
+                next_vid = self.policy.select(watch.recs, self.cur_slant)
+            if next_vid is None: # no scored rec, reseed from the db
+                self.logger.info("No recommendation with known slant. Reseeding from db...")
+                registry.inc("drift_fallbacks")
+                with registry.timer("fallback"):
+                    next_vid = await self.fallback()
+
+            if next_vid is not None:
+                self.logger.info(f"Up next video slant: {next_vid.slant}")
+                await async_db.run(self.sink.checkpoint, self.ID, self.cur_slant, self.cur_state, next_vid.id)
+
+
+    async def fallback(self) -> Video | None:
+        """Unwatched db video closest to the current slant"""
+        return await async_db.get_nearest_video(self.cur_slant, exclude=self.watched)
+
+
+    def completed(self, state : PuppetState) -> int:
+        return sum(1 for w in self.history if w.state == state)
+
+
+    async def resume(self):
+        """Restore state and history flushed by an earlier, possibly killed, run"""
+        if not self.resume_run:
+            await async_db.run(self.sink.reset, self.ID)
+
+        await async_db.run(self.sink.start, self.ID, self.initial_slant, self.target_slant)
+        checkpoint, self.history = await async_db.run(self.sink.load, self.ID)
+
+        if self.history:
+            self.cur_slant = checkpoint["cur_slant"]
+            self.cur_state = checkpoint["state"]
+            self.next_video_id = checkpoint["next_video_id"]
+            self.logger.info(f"Resuming from depth {len(self.history)} in state {self.cur_state}")
 
 
     async def serialize(self):
+        import pandas as pd
+
         rows = [
             {
                 "puppet_id": self.ID,
                 "puppet_state": w.state,
                 "puppet_slant": w.puppet_slant,
                 "depth": w.depth,
-                "video_id": w.video.id,
-                "video_slant": w.video.slant,
-                "recs_id": [r.id for r in w.recs],
-                "recs_slant": [r.slant for r in w.recs],
+                "video_id": w.video_id,
+                "video_slant": w.video_slant,
+                "recs_id": list(w.rec_ids),
+                "recs_slant": list(w.rec_slants),
             }
             for w in self.history
         ]
         return pd.DataFrame.from_records(rows)
 
 
-    async def run(self):
+    async def run(self, train_depth = 10, drift_depth = 10, wt = 5):
         self.logger.info(f"Running sock-puppet, {self.ID}")
 
+        await self.resume()
+        if self.cur_state == "closed":
+            self.logger.info("Puppet already finished. Skipping...")
+            return
+
+        self.watched = await async_db.new_exclusion([watch.video_id for watch in self.history])
+
         async with self.driver(**self.driver_args) as driver:
             await driver.consent_check()
 
-            self.logger.info("Initialising training...")
-            await self.train(driver, wt=5, depth=10)
+            if self.cur_state in ("init", "training"):
+                self.logger.info("Initialising training...")
+                await self.train(driver, wt=wt, depth=train_depth)
+                await async_db.run(self.sink.checkpoint, self.ID, self.cur_slant, "drifting")
 
             self.logger.info("Initialising drifting...")
-            await self.drift(driver, wt=5, depth=10)
+            await self.drift(driver, wt=wt, depth=drift_depth)
 
-            self.logger.info("Finished run. Saving...")
-            df = await self.serialize()
-            path = config.PUPPETS_DIR / f"{self.ID}.csv"
-            df.to_csv(path)
+            if self.export_dir is not None:
+                self.logger.info("Finished run. Saving...")
+                df = await self.serialize()
+                path = self.export_dir / f"{self.ID}.csv"
+                df.to_csv(path)
+                self.logger.info(f"Puppet data saved to {path}.")
 
-            self.logger.info(f"Puppet data saved to {path}. Closing...")
+            self.logger.info("Closing...")
+            if self.graph is not None: await self.graph.aflush()
             self.cur_state = "closed"
+            await async_db.run(self.sink.checkpoint, self.ID, self.cur_slant, self.cur_state)
 
 
 
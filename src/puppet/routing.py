@@ -0,0 +1,180 @@
+from patchright.async_api import BrowserContext, Page, Route, Response, async_playwright
+from dataclasses import dataclass, field, asdict
+import argparse
+import asyncio
+import json
+import re
+
+# watchtime / playback stats are left alone, youtube needs them to register the watch
+BLOCK_PATTERNS = [
+    r"i\.ytimg\.com/", # thumbnails
+    r"yt3\.(ggpht|googleusercontent)\.com/", # avatars
+    r"fonts\.(gstatic|googleapis)\.com/",
+    r"doubleclick\.net/",
+    r"googlesyndication\.com/",
+    r"googleadservices\.com/",
+    r"/pagead/",
+    r"/api/stats/(ads|qoe)",
+    r"/generate_204",
+]
+
+QUALITY_SCRIPT = """
+(quality) => {
+    if (!location.hostname.endsWith("youtube.com")) return;
+    const now = Date.now();
+    localStorage.setItem("yt-player-quality", JSON.stringify({
+        data: JSON.stringify({quality: quality, previousQuality: quality}),
+        expiration: now + 30 * 24 * 3600 * 1000,
+        creation: now,
+    }));
+}
+"""
+
+
+@dataclass
+class RouteConfig():
+    block_patterns : list[str] = field(default_factory=lambda: list(BLOCK_PATTERNS))
+    block_types : set[str] = field(default_factory=set) # e.g. {"image", "font"}, needs a catch-all route
+    max_quality : int | None = 144 # preferred player resolution
+    max_kbps : int | None = None # download throttle, player adapts its bitrate
+
+
+@dataclass
+class NetworkStats():
+    requests : int = 0
+    blocked : int = 0
+    bytes : int = 0 # from content-length, chunked responses are not counted
+
+    def reset(self):
+        self.requests = self.blocked = self.bytes = 0
+
+
+    def snapshot(self) -> dict:
+        return asdict(self)
+
+
+async def apply_routing(context : BrowserContext, page : Page, config : RouteConfig) -> NetworkStats:
+    """Install blocking routes and quality caps on a context, returns live per-page network counters"""
+    stats = NetworkStats()
+
+    async def abort(route : Route):
+        stats.blocked += 1
+        await route.abort()
+
+    if config.block_patterns: # only matching urls round-trip through python
+        await context.route(re.compile("|".join(config.block_patterns)), abort)
+
+    if config.block_types:
+        async def by_type(route : Route):
+            if route.request.resource_type in config.block_types:
+                await abort(route)
+            else:
+                await route.fallback()
+        await context.route("**/*", by_type)
+
+    if config.max_quality is not None:
+        await context.add_init_script(f"({QUALITY_SCRIPT})({json.dumps(config.max_quality)})")
+
+    if config.max_kbps is not None:
+        session = await context.new_cdp_session(page)
+        await session.send("Network.enable")
+        await session.send("Network.emulateNetworkConditions", {
+            "offline": False,
+            "latency": 0,
+            "downloadThroughput": config.max_kbps * 1024 / 8,
+            "uploadThroughput": -1,
+        })
+
+    def on_response(response : Response):
+        stats.requests += 1
+        stats.bytes += int(response.headers.get("content-length", 0) or 0)
+
+    page.on("response", on_response)
+    return stats
+
+
+FIXTURE_WATCH_URL = "https://www.youtube.com/watch?v=fixture"
+MEDIA_BYTES = 2**20 # dummy stream, large enough that media dominates the page's bytes like on a real watch
+
+# url -> content type. Thumbnails, fonts, ads and qoe pings match BLOCK_PATTERNS, the rest is the page itself
+FIXTURE_ASSETS = {
+    "https://i.ytimg.com/vi/fixture/hqdefault.jpg": "image/jpeg",
+    "https://fonts.googleapis.com/css?family=Roboto": "text/css",
+    "https://googleads.g.doubleclick.net/pagead/ad.js": "text/javascript",
+    "https://www.youtube.com/api/stats/qoe?docid=fixture": "image/gif",
+    "https://www.youtube.com/s/player/base.js": "text/javascript",
+    "https://www.youtube.com/img/logo.png": "image/png",
+    "https://rr1---sn-fixture.googlevideo.com/videoplayback?itag=18": "video/mp4",
+}
+
+FIXTURE_WATCH = """<!doctype html><html><head>
+<link rel="stylesheet" href="https://fonts.googleapis.com/css?family=Roboto">
+<script src="https://www.youtube.com/s/player/base.js"></script>
+<script src="https://googleads.g.doubleclick.net/pagead/ad.js"></script>
+</head><body>
+<img src="https://i.ytimg.com/vi/fixture/hqdefault.jpg">
+<img src="https://www.youtube.com/img/logo.png">
+<img src="https://www.youtube.com/api/stats/qoe?docid=fixture">
+<video src="https://rr1---sn-fixture.googlevideo.com/videoplayback?itag=18" preload="auto" muted></video>
+</body></html>"""
+
+
+async def serve_fixture(context : BrowserContext):
+    """ Answer the watch page and its assets from memory. Install before apply_routing, whose routes then take precedence """
+    async def fulfill(route : Route):
+        url = route.request.url
+        content_type = FIXTURE_ASSETS.get(url, "text/html")
+        body = FIXTURE_WATCH.encode() if url == FIXTURE_WATCH_URL else bytes(MEDIA_BYTES if content_type == "video/mp4" else 1024)
+        await route.fulfill(status=200, content_type=content_type, headers={"content-length": str(len(body))}, body=body)
+
+    await context.route("https://**", fulfill)
+
+
+async def check(headless : bool = True) -> bool:
+    """ Load the fixture watch page without routing, with the default routes and with images blocked by type.
+    Blocked counts must match the fixture and routing must cut the bytes transferred """
+    blockable = re.compile("|".join(BLOCK_PATTERNS))
+    expected = {
+        "none": 0,
+        "default": sum(bool(blockable.search(url)) for url in FIXTURE_ASSETS),
+        "images": sum(bool(blockable.search(url)) or ctype.startswith("image/") for url, ctype in FIXTURE_ASSETS.items()),
+    }
+    configs = {
+        "none": RouteConfig(block_patterns=[], max_quality=None),
+        "default": RouteConfig(),
+        "images": RouteConfig(block_types={"image"}),
+    }
+
+    results = {}
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=headless, channel="chrome")
+        try:
+            for name, route_config in configs.items():
+                context = await browser.new_context()
+                await serve_fixture(context)
+                page = await context.new_page()
+                stats = await apply_routing(context, page, route_config)
+                await page.goto(FIXTURE_WATCH_URL, wait_until="load")
+                await page.wait_for_timeout(500) # media fetch runs past the load event
+                quality = await page.evaluate("localStorage.getItem('yt-player-quality')")
+                results[name] = stats.snapshot()
+                print(f"{name}: {results[name]}, quality cap {'set' if quality else 'unset'}")
+                await context.close()
+        finally:
+            await browser.close()
+
+    failures = [f"{name} blocked {results[name]['blocked']}, expected {n}" for name, n in expected.items() if results[name]["blocked"] != n]
+    if results["default"]["bytes"] >= results["none"]["bytes"]:
+        failures.append("default routing did not reduce bytes")
+
+    for failure in failures: print(f"FAIL {failure}")
+    print("ok" if not failures else f"{len(failures)} failures")
+    return not failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check request routing against a local watch page with dummy media")
+    parser.add_argument("--headed", action="store_true")
+    args = parser.parse_args()
+
+    raise SystemExit(0 if asyncio.run(check(headless=not args.headed)) else 1)
@@ -0,0 +1,61 @@
+from patchright.async_api import Page
+
+from models import Recommendation
+
+# Waits (bounded) for the up-next panel to fill and settle, then extracts every entry in one pass.
+# Handles both the lockup view model and the older compact video renderer markup.
+RECS_SCRIPT = """
+([timeoutMs, quietMs]) => new Promise((resolve) => {
+    const ITEMS = "#secondary yt-lockup-view-model, #secondary ytd-compact-video-renderer, "
+        + "#secondary ytd-ad-slot-renderer, #secondary ytm-shorts-lockup-view-model, #secondary ytd-reel-shelf-renderer a[href*='/shorts/']";
+    const text = (el) => el?.textContent?.trim() || null;
+
+    const extract = () => [...document.querySelectorAll(ITEMS)].map((el, position) => {
+        const link = el.querySelector("a[href*='/watch?v='], a[href*='/shorts/']") ?? (el.matches("a") ? el : null);
+        const href = link?.getAttribute("href") ?? "";
+        const match = href.match(/(?:\\/watch\\?v=|\\/shorts\\/)([a-zA-Z0-9_-]{11})/);
+        return {
+            id: match?.[1] ?? null,
+            position: position,
+            title: text(el.querySelector(".yt-lockup-metadata-view-model__title, #video-title")),
+            channel: text(el.querySelector(".yt-content-metadata-view-model__metadata-row span, ytd-channel-name #text")),
+            is_short: href.includes("/shorts/") || el.matches("ytm-shorts-lockup-view-model, a"),
+            is_ad: el.matches("ytd-ad-slot-renderer") || !!el.closest("ytd-ad-slot-renderer")
+                || [...el.querySelectorAll("badge-shape, .badge")].some((b) => /sponsored|ad\\b/i.test(b.textContent)),
+            badges: [...el.querySelectorAll("badge-shape, ytd-badge-supported-renderer .badge")].map(text).filter(Boolean),
+        };
+    }).filter((r) => r.id);
+
+    let quietTimer = null;
+    const observer = new MutationObserver(() => {
+        clearTimeout(quietTimer);
+        quietTimer = setTimeout(done, quietMs);
+    });
+    const done = () => {
+        clearTimeout(quietTimer); clearTimeout(deadline);
+        observer.disconnect();
+        resolve(extract());
+    };
+    const deadline = setTimeout(done, timeoutMs); // return whatever loaded
+
+    observer.observe(document.documentElement, {childList: true, subtree: true});
+    if (document.querySelector(ITEMS)) quietTimer = setTimeout(done, quietMs); // already rendered, settle then extract
+})
+"""
+
+
+async def scrape_recommendations(page : Page, timeout : float = 10.0, quiet : float = 0.25) -> list[Recommendation]:
+    """Extract the up-next panel in a single round trip"""
+    items = await page.evaluate(RECS_SCRIPT, [timeout * 1000, quiet * 1000])
+    return [
+        Recommendation(
+            id=item["id"],
+            title=item["title"],
+            channel=item["channel"],
+            position=item["position"],
+            is_short=item["is_short"],
+            is_ad=item["is_ad"],
+            badges=item["badges"],
+        )
+        for item in items
+    ]
@@ -0,0 +1,103 @@
+from dataclasses import dataclass
+import asyncio
+
+import numpy as np
+
+from data_fetcher.db import get_slant_index
+from data_fetcher.slant_index import SlantIndex
+from models import Video, Playback, Recommendation
+from .driver import VideoUnavailableException
+from .graph import RecGraph
+
+
+@dataclass
+class RecommenderModel():
+    n_recs : int = 20
+    homophily : float = 0.8 # share of recs drawn near the watched video's slant, the rest uniformly
+    sigma : float = 0.15 # slant spread of the homophilous recs
+    popularity : float = 1.0 # exponent on the pareto popularity of a video, 0 disables the bias
+    oversample : int = 4 # candidates per rec before popularity weighting
+    unavailable_rate : float = 0.0
+    time_scale : float = 0.0 # fraction of the requested watch time actually slept
+    empirical : float = 0.0 # share of recs replayed from edges observed on real YouTube, needs a graph
+
+
+class SimulatedDriver():
+    """Driver that serves synthetic recommendations from the slant db instead of YouTube"""
+    _popularity : dict[tuple[int, float], np.ndarray] = {} # per index size and exponent, shared by all drivers in the process
+
+    def __init__(self, model : RecommenderModel | None = None, seed : int | None = None, logger=None, graph : RecGraph | None = None, **kwargs):
+        self.model = model or RecommenderModel()
+        self.logger = logger
+        self.graph = graph # empirical recommender
+        self.network = None
+        self.playback : Playback | None = None
+        self._rng = np.random.default_rng(seed)
+        self._index : SlantIndex | None = None
+
+
+    async def __aenter__(self):
+        self._index = await asyncio.to_thread(get_slant_index)
+        return self
+
+
+    async def __aexit__(self, exc_type, exc, tb):
+        pass
+
+
+    async def consent_check(self):
+        pass
+
+
+    def popularity(self) -> np.ndarray:
+        key = (len(self._index), self.model.popularity) # draws are seeded, so equal keys give equal weights
+        if key not in self._popularity:
+            rng = np.random.default_rng(0)
+            self._popularity[key] = (rng.pareto(1.5, size=len(self._index)) + 1) ** self.model.popularity
+        return self._popularity[key]
+
+
+    def replay(self, video_id : str, n : int) -> list[str]:
+        """ Up to n recs drawn, by observed count, from what YouTube recommended after this video """
+        ids, counts = self.graph.successors(video_id)
+        if not ids:
+            return []
+        n = min(n, len(ids))
+        return [ids[i] for i in self._rng.choice(len(ids), size=n, replace=False, p=counts / counts.sum())]
+
+
+    def recommend(self, slant : float | None, video_id : str | None = None) -> list[str]:
+        index, model, rng = self._index, self.model, self._rng
+
+        observed = []
+        if self.graph is not None and model.empirical > 0 and video_id is not None:
+            observed = self.replay(video_id, rng.binomial(model.n_recs, model.empirical))
+        if len(observed) >= model.n_recs:
+            return observed
+
+        k = model.n_recs * model.oversample
+
+        if slant is None: slant = rng.uniform(-1, 1)
+        near = rng.random(k) < model.homophily
+        targets = np.where(near, rng.normal(slant, model.sigma, k), rng.uniform(-1, 1, k))
+        pos = np.clip(np.searchsorted(index.slants, targets), 0, len(index) - 1)
+        pos = np.unique(pos)
+
+        weights = self.popularity()[pos]
+        n = min(model.n_recs, len(pos))
+        synthetic = index.ids[rng.choice(pos, size=n, replace=False, p=weights / weights.sum())]
+        return list(dict.fromkeys([*observed, *synthetic]))[:model.n_recs] # observed recs first, synthetic ones fill up
+
+
+    async def watch(self, vid : Video, time : float) -> tuple[Video, list[Recommendation]]:
+        assert self._index is not None
+
+        if self.model.unavailable_rate and self._rng.random() < self.model.unavailable_rate:
+            raise VideoUnavailableException()
+
+        if self.model.time_scale > 0:
+            await asyncio.sleep(time * self.model.time_scale)
+        self.playback = Playback(watch_time=time * self.model.time_scale)
+
+        ids = self.recommend(vid.slant, vid.id)
+        return vid, [Recommendation(id, position=i) for i, id in enumerate(ids)]
@@ -0,0 +1,141 @@
+import time
+from functools import lru_cache
+from pathlib import Path
+
+import config
+from data_fetcher.db import ConnectionPool
+from models import Watch, WatchRecord
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS puppet (
+  id TEXT PRIMARY KEY,
+  initial_slant REAL,
+  target_slant REAL,
+  cur_slant REAL,
+  state TEXT,
+  next_video_id TEXT,
+  updated_at REAL
+);
+
+CREATE TABLE IF NOT EXISTS watch (
+  puppet_id TEXT,
+  depth INTEGER,
+  state TEXT,
+  puppet_slant REAL,
+  video_id TEXT,
+  video_slant REAL,
+  title TEXT,
+  watch_time REAL,
+  stalls INTEGER,
+  stall_time REAL,
+  requests INTEGER,
+  bytes INTEGER,
+  watched_at REAL,
+  PRIMARY KEY (puppet_id, depth)
+);
+
+CREATE TABLE IF NOT EXISTS rec (
+  puppet_id TEXT,
+  depth INTEGER,
+  position INTEGER,
+  video_id TEXT,
+  slant REAL,
+  title TEXT,
+  channel TEXT,
+  is_short INTEGER,
+  is_ad INTEGER,
+  inferred INTEGER,
+  PRIMARY KEY (puppet_id, depth, position)
+);
+"""
+
+
+class TrajectoryWriter():
+    """Append-only sqlite sink for puppet trajectories, one row per watch and per recommendation.
+    Every watch is committed on its own, so a killed puppet can resume from its last flushed depth"""
+    def __init__(self, path : Path = config.TRAJECTORY_DB_PATH):
+        self.pool = ConnectionPool(path)
+        with self.pool.get() as con:
+            con.executescript(SCHEMA)
+            columns = {row[1] for row in con.execute("PRAGMA table_info(rec)")}
+            if "inferred" not in columns: # stores created before slant inference
+                con.execute("ALTER TABLE rec ADD COLUMN inferred INTEGER")
+
+
+    def start(self, puppet_id : str, initial_slant : float, target_slant : float):
+        with self.pool.get() as con:
+            con.execute("""
+                INSERT OR IGNORE INTO puppet (id, initial_slant, target_slant, cur_slant, state, updated_at)
+                VALUES (?, ?, ?, ?, 'init', ?)
+                """,
+                (puppet_id, initial_slant, target_slant, initial_slant, time.time())
+            )
+
+
+    def reset(self, puppet_id : str):
+        with self.pool.get() as con:
+            for table, column in (("puppet", "id"), ("watch", "puppet_id"), ("rec", "puppet_id")):
+                con.execute(f"DELETE FROM {table} WHERE {column} = ?", (puppet_id,))
+
+
+    def write(self, watch : Watch):
+        playback, network = watch.playback, watch.network or {}
+        with self.pool.get() as con: # one transaction per watch
+            con.execute("""
+                INSERT OR REPLACE INTO watch
+                (puppet_id, depth, state, puppet_slant, video_id, video_slant, title, watch_time, stalls, stall_time, requests, bytes, watched_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    watch.puppet_id, watch.depth, watch.state, watch.puppet_slant, watch.video.id, watch.video.slant, watch.video.title,
+                    playback.watch_time if playback else None, playback.stalls if playback else None, playback.stall_time if playback else None,
+                    network.get("requests"), network.get("bytes"), time.time()
+                )
+            )
+            con.executemany("""
+                INSERT OR REPLACE INTO rec
+                (puppet_id, depth, position, video_id, slant, title, channel, is_short, is_ad, inferred)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                [
+                    (watch.puppet_id, watch.depth, i, r.id, r.slant, r.title, r.channel, getattr(r, "is_short", False), getattr(r, "is_ad", False), getattr(r, "inferred", False))
+                    for i, r in enumerate(watch.recs)
+                ]
+            )
+
+
+    def checkpoint(self, puppet_id : str, cur_slant : float, state : str, next_video_id : str | None = None):
+        with self.pool.get() as con:
+            con.execute("""
+                UPDATE puppet SET cur_slant = ?, state = ?, next_video_id = ?, updated_at = ?
+                WHERE id = ?
+                """,
+                (cur_slant, state, next_video_id, time.time(), puppet_id)
+            )
+
+
+    def load(self, puppet_id : str) -> tuple[dict | None, list[WatchRecord]]:
+        """Checkpoint row and flushed history of a puppet, for resuming"""
+        con = self.pool.get()
+        row = con.execute("SELECT cur_slant, state, next_video_id FROM puppet WHERE id = ?", (puppet_id,)).fetchone()
+        checkpoint = dict(zip(("cur_slant", "state", "next_video_id"), row)) if row is not None else None
+
+        recs : dict[int, list] = {}
+        for depth, id, slant in con.execute("SELECT depth, video_id, slant FROM rec WHERE puppet_id = ? ORDER BY depth, position", (puppet_id,)):
+            recs.setdefault(depth, []).append((id, slant))
+
+        history = [
+            WatchRecord(
+                state, puppet_slant, depth, video_id, video_slant,
+                tuple(r[0] for r in recs.get(depth, [])), tuple(r[1] for r in recs.get(depth, []))
+            )
+            for depth, state, puppet_slant, video_id, video_slant in con.execute(
+                "SELECT depth, state, puppet_slant, video_id, video_slant FROM watch WHERE puppet_id = ? ORDER BY depth", (puppet_id,)
+            )
+        ]
+        return checkpoint, history
+
+
+@lru_cache(maxsize=1)
+def get_writer() -> TrajectoryWriter:
+    return TrajectoryWriter()
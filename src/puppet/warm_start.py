@@ -0,0 +1,140 @@
+from patchright.async_api import BrowserContext, Route
+from pathlib import Path
+import argparse
+import asyncio
+import logging
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+
+from models import Video
+import config
+
+TEMPLATE_ID = "_template"
+CONSENT_COOKIES = ("SOCS", "CONSENT")
+
+
+def template_dir(root : Path = config.SESSION_DIR) -> Path:
+    return root / TEMPLATE_ID
+
+
+def template_state(root : Path = config.SESSION_DIR) -> Path:
+    return root / f"{TEMPLATE_ID}.json"
+
+
+async def has_consent(context : BrowserContext) -> bool:
+    """ Cookie consent already given in this context """
+    for cookie in await context.cookies("https://www.youtube.com"):
+        if cookie["name"] == "SOCS": return True
+        if cookie["name"] == "CONSENT" and cookie["value"].startswith("YES"): return True # PENDING+ means not yet
+    return False
+
+
+def clone_profile(dst : Path, root : Path = config.SESSION_DIR) -> bool:
+    """ Copy-on-write clone of the template profile into a new puppet's profile dir. Existing profiles are left alone """
+    src = template_dir(root)
+    if dst.exists() or not src.exists():
+        return False
+
+    # chrome rewrites its sqlite files in place, so hardlinks would leak writes into the template
+    try:
+        subprocess.run(["cp", "-R", "--reflink=auto", str(src), str(dst)], check=True, capture_output=True)
+    except (OSError, subprocess.CalledProcessError): # no GNU cp
+        shutil.rmtree(dst, ignore_errors=True)
+        shutil.copytree(src, dst)
+    return True
+
+
+def clone_state(dst : Path, root : Path = config.SESSION_DIR) -> bool:
+    """ Seed a pooled puppet's storage-state file from the template """
+    src = template_state(root)
+    if dst.exists() or not src.exists():
+        return False
+    shutil.copyfile(src, dst)
+    return True
+
+
+async def build_template(root : Path = config.SESSION_DIR, headless : bool = True, logger : logging.Logger | None = None, setup=None):
+    """ Accept consent once in a fresh profile and keep it, as a profile dir and as a storage-state file """
+    from .youtube_driver import YouTubeDriver
+
+    logger = logger or logging.getLogger("WarmStart")
+    shutil.rmtree(template_dir(root), ignore_errors=True)
+
+    async with YouTubeDriver(template_dir(root), headless, config.UBLOCK_PATH, logger, warm_start=False, setup=setup) as driver:
+        await driver.consent_check()
+        await driver.save_state(template_state(root))
+        if not driver.consented:
+            logger.warning("No consent cookie after the consent flow, puppets will cold start")
+
+    logger.info(f"Saved warm-start template to {template_dir(root)}")
+
+
+FIXTURE_HOME = """<!doctype html><html><body>
+<button aria-label="Accept the use of cookies and other data for the purposes described"
+  onclick="document.cookie = 'SOCS=CAI; path=/; max-age=31536000'">Accept all</button>
+</body></html>"""
+
+FIXTURE_WATCH = """<!doctype html><html><body>
+<h1 class="ytd-watch-metadata"><yt-formatted-string title="Fixture video">Fixture video</yt-formatted-string></h1>
+</body></html>"""
+
+
+async def serve_fixture(context : BrowserContext):
+    """ Answer youtube.com from local pages, so startup can be timed without the network """
+    async def fulfill(route : Route):
+        body = FIXTURE_WATCH if "/watch" in route.request.url else FIXTURE_HOME
+        await route.fulfill(status=200, content_type="text/html", body=body)
+
+    await context.route("https://www.youtube.com/**", fulfill)
+
+
+async def time_to_first_watch(session_dir : Path, warm_start : bool, headless : bool, logger : logging.Logger) -> float:
+    """ Seconds from driver start until the first watch page has loaded """
+    from .youtube_driver import YouTubeDriver
+
+    start = time.perf_counter()
+    async with YouTubeDriver(session_dir, headless, config.UBLOCK_PATH, logger, warm_start=warm_start, setup=serve_fixture) as driver:
+        await driver.consent_check()
+        await driver.navigate(Video("fixture"))
+        return time.perf_counter() - start
+
+
+async def bench(n : int, headless : bool = True):
+    """ Cold versus warm time to first watch against the local fixture """
+    logger = logging.getLogger("WarmStart")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        cold = [await time_to_first_watch(root / f"cold-{i}", False, headless, logger) for i in range(n)]
+
+        await build_template(root, headless, logger, setup=serve_fixture)
+        warm = []
+        for i in range(n):
+            clone_profile(root / f"warm-{i}", root)
+            warm.append(await time_to_first_watch(root / f"warm-{i}", True, headless, logger))
+
+    for name, times in (("cold", cold), ("warm", warm)):
+        print(f"{name}: mean {statistics.mean(times):.2f}s, median {statistics.median(times):.2f}s over {n} starts")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Consented session template for warm puppet starts")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+
+    p_build = sub.add_parser("build", help="create the template in the session dir")
+    p_build.add_argument("--headed", action="store_true")
+
+    p_bench = sub.add_parser("bench", help="time to first watch, cold vs warm, against a local fixture")
+    p_bench.add_argument("-n", type=int, default=5)
+    p_bench.add_argument("--headed", action="store_true")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    config.init()
+    if args.cmd == "build":
+        asyncio.run(build_template(headless=not args.headed))
+    else:
+        asyncio.run(bench(args.n, headless=not args.headed))
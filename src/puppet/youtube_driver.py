@@ -1,53 +1,101 @@
 from patchright.async_api import Page, Playwright, BrowserContext, async_playwright
 from pathlib import Path
-import re 
+from typing import Awaitable, Callable
 import asyncio
 import logging
-from models import Video 
-
-class VideoUnavailableException(Exception):
-    pass
+import sys
+from models import Video, Playback, Recommendation
+from .browser_pool import BrowserPool
+from .routing import RouteConfig, NetworkStats, apply_routing
+from .playback import monitor_playback
+from .scrape import scrape_recommendations
+from .driver import VideoUnavailableException
+from .warm_start import has_consent, clone_profile, clone_state
+from metrics import registry
 
 class YouTubeDriver():
     """Async context manager for interacting with YouTube using Playwright"""
-    def __init__(self, session_dir : Path, headless : bool, ublock_path : Path, logger : logging.Logger):
+    def __init__(self, session_dir : Path, headless : bool, ublock_path : Path, logger : logging.Logger, pool : BrowserPool | None = None,
+                 routing : RouteConfig | None = None, warm_start : bool = False, setup : Callable[[BrowserContext], Awaitable[None]] | None = None):
         self.session_dir = session_dir
         self.headless = headless
         self.ublock_path = ublock_path
         self.logger = logger
+        self.pool = pool
+        self.routing = routing
+        self.warm_start = warm_start # seed new sessions from the consented template
+        self.setup = setup # extra context setup after routing, e.g. local fixtures
+        self.network : NetworkStats | None = None
+        self.playback : Playback | None = None
+        self.consented = False
 
         self._page : Page | None = None
         self._context : BrowserContext | None = None
         self._playwright : Playwright | None = None
+        self._lease = None
 
 
     async def __aenter__(self):
-        """ Launch session with persistent context """
-        self._playwright = await async_playwright().start()
-        self.session_dir.mkdir(exist_ok=True) #create dir if not exists
-
-        self._context = await self._playwright.chromium.launch_persistent_context(
-            self.session_dir,
-            headless=self.headless,
-            channel="chrome",
-            #no_viewport=True,
-            args=[
-                #f"--disable-extensions-except={self.ublock_path.absolute()}",
-                #f"--load-extension={self.ublock_path.absolute()}",
-            ]
-        )
+        """ Launch session with persistent context, or lease a context from the browser pool """
+        if self.warm_start: # only new puppets are seeded, existing sessions keep their own history
+            cloned = clone_state(self.pool.state_path(self.session_dir.name), self.pool.session_dir) if self.pool is not None \
+                else clone_profile(self.session_dir, self.session_dir.parent)
+            if cloned: self.logger.info("Session cloned from warm-start template.")
+
+        try:
+            if self.pool is not None:
+                lease = self.pool.lease(self.session_dir.name)
+                self._context = await lease.__aenter__()
+                self._lease = lease # only once entered, __aexit__ must not resume a lease that never started
+            else:
+                self._playwright = await async_playwright().start()
+                self.session_dir.mkdir(exist_ok=True) #create dir if not exists
+
+                self._context = await self._playwright.chromium.launch_persistent_context(
+                    self.session_dir,
+                    headless=self.headless,
+                    channel="chrome",
+                    #no_viewport=True,
+                    args=[
+                        #f"--disable-extensions-except={self.ublock_path.absolute()}",
+                        #f"--load-extension={self.ublock_path.absolute()}",
+                    ]
+                )
+
+            await self._open_page()
+        except BaseException: # async with skips __aexit__ when __aenter__ raises, release the lease or browser here
+            await self.__aexit__(*sys.exc_info())
+            raise
+
+        return self
+
+
+    async def _open_page(self):
         self._page = self._context.pages[0] if self._context.pages else await self._context.new_page()
 
+        if self.routing is not None:
+            self.network = await apply_routing(self._context, self._page, self.routing)
+
+        if self.setup is not None:
+            await self.setup(self._context)
+
+        self.consented = await has_consent(self._context)
+        if self.consented: # warm session, the first watch can go straight to the video
+            self.logger.info("Initialising YouTube Driver from consented session.")
+            return
+
         session = await self._context.new_cdp_session(self._page)
         info = await session.send("Browser.getVersion")
         self.logger.info("Initialising YouTube Driver.")
 
         await self._page.goto("https://www.youtube.com")
 
-        return self
-
 
     async def __aexit__(self, exc_type, exc, tb):
+        if self._lease is not None: # pool saves storage state and closes the context
+            await self._lease.__aexit__(exc_type, exc, tb)
+            return
+
         try:
             if self._context: await self._context.close()
         finally:
@@ -57,6 +105,8 @@ class YouTubeDriver():
     async def consent_check(self):
         """ Accept cookie consent prompt """
         assert self._page
+        if self.consented:
+            return
 
         consent_btn = self._page.locator('button[aria-label*="Accept the use of cookies"]')
         if await consent_btn.count() > 0:
@@ -64,45 +114,61 @@ class YouTubeDriver():
             await consent_btn.press("Enter")
             await asyncio.sleep(1)
             await self._page.reload()
+        self.consented = await has_consent(self._context)
 
 
-    async def watch(self, vid : Video, time : float) -> tuple[Video, list[Video]]:
+    async def save_state(self, path : Path):
+        """ Write cookies and local storage to a storage-state file """
+        assert self._context
+        await self._context.storage_state(path=path)
+
+
+    async def navigate(self, vid : Video):
         assert self._page
 
         url = f"https://www.youtube.com/watch?v={vid.id}"
         await self._page.goto(url)
         await self._page.wait_for_load_state("domcontentloaded")
 
-        # check for video errors
-        error = self._page.locator("yt-player-error-message-renderer")
-        if await error.count() > 0:
-            self.logger.warning(f"Video with id {vid.id} is unavailable.")
-            raise VideoUnavailableException()
-
-        # check for title element
-        title_elem = self._page.locator("h1.ytd-watch-metadata yt-formatted-string")
-        if await title_elem.count() < 1:
-            raise VideoUnavailableException()
-        
-        title = await title_elem.get_attribute("title")
-        vid.title = title
-        self.logger.info(f"Playing video: {vid.title}")
 
-        #monitor playback time
-        await asyncio.sleep(time)
-        wt = 0
-        while wt <= time:
-            wt = await self._page.evaluate("document.querySelector('video')?.currentTime ?? 0") # get player time
+    async def watch(self, vid : Video, time : float) -> tuple[Video, list[Recommendation]]:
+        assert self._page
 
-            if wt == 0: # if playback stalled, try hitting play again
-                await self._page.keyboard.press("k")
+        if self.network: self.network.reset() # per-watch counters
+        self.playback = None
 
-            await asyncio.sleep(1)
-            self.logger.debug(f"Playback time: {wt}")
+        with registry.timer("navigate"):
+            await self.navigate(vid)
 
-        #get up next video ids
-        thumbs = await self._page.locator("a.yt-lockup-metadata-view-model__title").all()
-        urls = [await x.get_attribute("href") for x in thumbs]
-        ids = [re.search(r"/watch\?v=([a-zA-Z0-9_-]{11})", x).group(1) for x in urls] # extract ids
-        recs = [Video(id) for id in ids]
+        with registry.timer("error_check"):
+            # check for video errors
+            error = self._page.locator("yt-player-error-message-renderer")
+            if await error.count() > 0:
+                self.logger.warning(f"Video with id {vid.id} is unavailable.")
+                registry.inc("unavailable")
+                raise VideoUnavailableException()
+
+            # check for title element
+            title_elem = self._page.locator("h1.ytd-watch-metadata yt-formatted-string")
+            if await title_elem.count() < 1:
+                registry.inc("unavailable")
+                raise VideoUnavailableException()
+
+            title = await title_elem.get_attribute("title")
+        vid.title = title
+        self.logger.info(f"Playing video: {vid.title}")
+
+        #monitor playback time
+        with registry.timer("playback"):
+            self.playback = await monitor_playback(self._page, time)
+        if self.playback.blocked:
+            self.logger.warning(f"Playback blocked at {self.playback.watch_time:.1f}s of {time}s, play() refused after {self.playback.kicks} kicks.")
+            registry.inc("playback_blocked")
+        elif self.playback.timed_out:
+            self.logger.warning(f"Playback timed out at {self.playback.watch_time:.1f}s of {time}s.")
+            registry.inc("playback_timeouts")
+
+        #get up next videos
+        with registry.timer("scrape"):
+            recs = await scrape_recommendations(self._page)
         return vid, recs  
\ No newline at end of file
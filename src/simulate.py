@@ -0,0 +1,91 @@
+import argparse
+import asyncio
+import logging
+import time
+from functools import wraps
+from pathlib import Path
+
+import numpy as np
+
+import config
+from metrics import registry
+from data_fetcher import async_db, db
+from puppet import YTPuppet
+from puppet.sim_driver import SimulatedDriver, RecommenderModel
+from puppet.trajectory import TrajectoryWriter
+from puppet.graph import RecGraph
+from puppet.policy import make_policy
+
+
+def timed(owner, name : str, stage : str):
+    """Time a stage function that has no instrumentation of its own"""
+    fn = getattr(owner, name)
+
+    if asyncio.iscoroutinefunction(fn):
+        @wraps(fn)
+        async def wrapper(*args, **kwargs):
+            with registry.timer(stage): return await fn(*args, **kwargs)
+    else:
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with registry.timer(stage): return fn(*args, **kwargs)
+
+    setattr(owner, name, wrapper)
+
+
+async def simulate(n : int, concurrency : int, train_depth : int, drift_depth : int, model : RecommenderModel, seed : int | None, policy : str = "nearest",
+                   replay : RecGraph | None = None):
+    sink = TrajectoryWriter(config.DB_DIR / "simulation.sqlite")
+    graph = RecGraph(config.DB_DIR / "simulation_graph.sqlite") # keep simulated edges out of the real graph
+    slots = asyncio.Semaphore(concurrency)
+    rng = np.random.default_rng(seed)
+
+    async def run(i):
+        slant, target = rng.uniform(-1, 1, 2)
+        puppet = YTPuppet(
+            f"sim-{i}", slant=slant, target_slant=target, sink=sink, resume=False, export_dir=None,
+            driver=SimulatedDriver, driver_args={"model": model, "seed": None if seed is None else seed + i, "graph": replay},
+            policy=make_policy(policy, seed=None if seed is None else seed + i), graph=graph,
+        )
+        async with slots:
+            await puppet.run(train_depth=train_depth, drift_depth=drift_depth, wt=0)
+        return len(puppet.history)
+
+    return await asyncio.gather(*[run(i) for i in range(n)])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the puppet pipeline against a simulated YouTube")
+    parser.add_argument("--puppets", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=100, help="puppets running at once")
+    parser.add_argument("--train-depth", type=int, default=10)
+    parser.add_argument("--drift-depth", type=int, default=10)
+    parser.add_argument("--homophily", type=float, default=0.8)
+    parser.add_argument("--sigma", type=float, default=0.15)
+    parser.add_argument("--popularity", type=float, default=1.0)
+    parser.add_argument("--time-scale", type=float, default=0.0, help="fraction of watch time actually slept")
+    parser.add_argument("--empirical", type=float, default=0.0, help="share of recs replayed from the recorded recommendation graph")
+    parser.add_argument("--graph", type=Path, default=config.GRAPH_DB_PATH, help="recommendation graph replayed by --empirical")
+    parser.add_argument("--policy", default="nearest", help="drift policy: nearest, softmax:<temperature> or egreedy:<epsilon>")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--log", action="store_true", help="keep puppet and db info logging")
+    parser.add_argument("--metrics", type=Path, default=None, help="export metrics, Prometheus text for .prom, JSON lines otherwise")
+    args = parser.parse_args()
+
+    if not args.log: logging.disable(logging.INFO)
+    db.init()
+
+    timed(async_db, "get_videos", "sample")
+
+    model = RecommenderModel(homophily=args.homophily, sigma=args.sigma, popularity=args.popularity, time_scale=args.time_scale, empirical=args.empirical)
+    replay = RecGraph(args.graph) if args.empirical > 0 else None
+
+    start = time.perf_counter()
+    depths = asyncio.run(simulate(args.puppets, args.concurrency, args.train_depth, args.drift_depth, model, args.seed, args.policy, replay))
+    elapsed = time.perf_counter() - start
+
+    watches = sum(depths)
+    print(f"{args.puppets} puppets, {watches} watches in {elapsed:.2f}s, policy {args.policy}")
+    print(f"{args.puppets / elapsed:.1f} puppets/s, {watches / elapsed:.1f} watches/s")
+    print(registry.summary())
+    if args.metrics: registry.export(args.metrics)
@@ -0,0 +1,189 @@
+import asyncio
+import importlib
+import multiprocessing as mp
+from multiprocessing.queues import Queue
+import queue
+import signal
+import time
+from collections import deque
+from dataclasses import dataclass
+
+import config
+from metrics import registry
+
+PROGRESS_INTERVAL = 5 # seconds between progress reports from a worker
+STOP_GRACE = 30 # seconds a stopping worker gets to close its drivers before it is killed
+
+
+@dataclass
+class PuppetSpec():
+    id : str
+    slant : float
+    target_slant : float
+
+
+def load_driver(path : str):
+    """Import a driver class from a dotted path, e.g. puppet.youtube_driver.YouTubeDriver"""
+    module, name = path.rsplit(".", 1)
+    return getattr(importlib.import_module(module), name)
+
+
+async def run_isolated(puppet, retries : int, progress : Queue | None = None):
+    """Run one puppet, retrying on failure without touching its siblings. Retries resume from the trajectory store"""
+    for attempt in range(retries + 1):
+        try:
+            await puppet.run()
+            if progress: progress.put(("done", puppet.ID, len(puppet.history)))
+            return True
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            puppet.logger.exception(f"Puppet failed on attempt {attempt + 1}/{retries + 1}")
+            if progress: progress.put(("failed", puppet.ID, repr(e)))
+    if progress: progress.put(("skipped", puppet.ID, len(puppet.history)))
+    return False
+
+
+async def run_shard(specs : list[PuppetSpec], driver : str, retries : int, pooled : bool, progress : Queue | None = None):
+    """Run M puppets in one event loop"""
+    from puppet import YTPuppet, BrowserPool
+
+    async def report(puppets):
+        while True:
+            await asyncio.sleep(PROGRESS_INTERVAL)
+            for p in puppets: progress.put(("depth", p.ID, len(p.history)))
+
+    async def run(pool):
+        puppets = [YTPuppet(s.id, slant=s.slant, target_slant=s.target_slant, pool=pool, driver=load_driver(driver)) for s in specs]
+        reporter = asyncio.create_task(report(puppets)) if progress else None
+        try:
+            return await asyncio.gather(*[run_isolated(p, retries, progress) for p in puppets])
+        finally:
+            if reporter: reporter.cancel()
+
+    if not pooled:
+        return await run(None)
+    async with BrowserPool(max_browsers=1, contexts_per_browser=len(specs)) as pool:
+        return await run(pool)
+
+
+def worker_main(specs : list[PuppetSpec], driver : str, retries : int, pooled : bool, progress : Queue):
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # the supervisor decides when to stop
+
+    async def main():
+        task = asyncio.current_task()
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, task.cancel) # graceful: drivers close, watches are flushed
+        await run_shard(specs, driver, retries, pooled, progress)
+
+    try:
+        asyncio.run(main())
+    except asyncio.CancelledError:
+        pass
+    finally:
+        progress.put(("metrics", None, registry.snapshot())) # merged into the supervisor's registry
+
+
+class Supervisor():
+    """Shards puppets across worker processes, M puppets per worker event loop"""
+    def __init__(self, workers : int = config.WORKERS, per_worker : int = config.PUPPETS_PER_WORKER, retries : int = config.PUPPET_RETRIES,
+                 driver : str = "puppet.youtube_driver.YouTubeDriver", pooled : bool = True):
+        self.workers = workers
+        self.per_worker = per_worker
+        self.retries = retries
+        self.driver = driver
+        self.pooled = pooled
+
+        self.ctx = mp.get_context("spawn")
+        self.progress = self.ctx.Queue()
+        self.status : dict[str, str] = {}
+        self.depth : dict[str, int] = {}
+        self.stopping = False
+
+
+    def stop(self, *args):
+        self.stopping = True
+
+
+    def handle(self, msg : tuple):
+        kind, id, value = msg
+        if kind == "metrics":
+            registry.merge(value)
+        elif kind == "depth":
+            self.depth[id] = value
+        elif kind == "failed":
+            print(f"{id} failed: {value}")
+        else:
+            self.status[id] = kind
+            if isinstance(value, int): self.depth[id] = value
+
+
+    def run(self, specs : list[PuppetSpec]) -> dict[str, str]:
+        shards = deque(specs[i:i+self.per_worker] for i in range(0, len(specs), self.per_worker))
+        running : dict[mp.Process, list[PuppetSpec]] = {}
+        crashes : dict[int, int] = {}
+        signalled : dict[mp.Process, float] = {} # when each worker was asked to stop
+        self.status = {s.id: "pending" for s in specs}
+
+        previous = signal.signal(signal.SIGTERM, self.stop)
+        last_report = time.monotonic()
+        try:
+            while shards or running:
+                while shards and len(running) < self.workers and not self.stopping:
+                    shard = shards.popleft()
+                    proc = self.ctx.Process(target=worker_main, args=(shard, self.driver, self.retries, self.pooled, self.progress), daemon=True)
+                    proc.start()
+                    running[proc] = shard
+                    for s in shard: self.status[s.id] = "running"
+
+                if self.stopping:
+                    for proc in running:
+                        if not proc.is_alive(): continue
+                        if proc not in signalled:
+                            proc.terminate() # SIGTERM once, a second one would cancel the worker's cleanup
+                            signalled[proc] = time.monotonic()
+                        elif time.monotonic() - signalled[proc] > STOP_GRACE:
+                            print(f"Worker {proc.pid} still running {STOP_GRACE}s after SIGTERM. Killing...")
+                            proc.kill()
+                            signalled[proc] = float("inf")
+                    for shard in shards:
+                        for s in shard: self.status[s.id] = "stopped"
+                    shards.clear()
+
+                try:
+                    self.handle(self.progress.get(timeout=0.5))
+                    while True: self.handle(self.progress.get_nowait())
+                except queue.Empty:
+                    pass
+
+                for proc in [p for p in running if not p.is_alive()]:
+                    shard = running.pop(proc)
+                    unfinished = [s for s in shard if self.status[s.id] == "running"]
+                    if proc.exitcode != 0 and unfinished and not self.stopping: # whole worker died, rerun what it left
+                        key = id(shard)
+                        crashes[key] = crashes.get(key, 0) + 1
+                        if crashes[key] <= self.retries:
+                            print(f"Worker {proc.pid} exited with {proc.exitcode}. Restarting {len(unfinished)} puppets...")
+                            shards.append(shard)
+                            continue
+                    for s in unfinished: self.status[s.id] = "stopped" if self.stopping else "skipped"
+
+                if time.monotonic() - last_report > PROGRESS_INTERVAL:
+                    last_report = time.monotonic()
+                    print(self.summary())
+        finally:
+            signal.signal(signal.SIGTERM, previous)
+
+        try: # metrics sent by the last workers on their way out
+            while True: self.handle(self.progress.get(timeout=0.5))
+        except queue.Empty:
+            pass
+
+        print(self.summary())
+        print(registry.summary())
+        return self.status
+
+
+    def summary(self) -> str:
+        counts : dict[str, int] = {}
+        for s in self.status.values(): counts[s] = counts.get(s, 0) + 1
+        return f"Puppets: {counts}, watches: {sum(self.depth.values())}"